@@ -1,10 +1,16 @@
 import asyncio
 import threading
+from contextlib import nullcontext
 from pathlib import Path
 
 from application.bin.account_service.account_container import AccountContainer
 from application.bin.systemd_agent_service.agent_service import AgentService
+from application.bin.systemd_agent_service.limits import ConcurrencyLimits
+from application.bin.systemd_agent_service.runtime import AgentRuntime
+from application.bin.systemd_agent_service.sweep import ParameterSweep
+from application.dtos.agent_runtime_config import AgentRuntimeConfig
 from application.dtos.agent_service_config import AgentServiceConfig, InitPrompts, Trait
+from application.metrics import METRICS, MetricsDumper
 from application.models import ModelID
 
 shutdown_event = threading.Event()
@@ -46,16 +52,41 @@ def preprocess_test() -> None:
     from application.bin.systemd_preprocessing_service.preprocess_v2 import (
         run_preprocess,
     )
+    from application.dtos.preprocess_config import PreprocessConfig
 
     json_path = Path("data/full_game_events_1.json")
 
-    asyncio.run(run_preprocess(json_path=json_path))
+    asyncio.run(run_preprocess(json_path=json_path, config=PreprocessConfig(streaming=True, bulk_insert=True)))
 
 
-def run_agent_service(configs: list[AgentServiceConfig]) -> None:
-    for config in configs:
-        print(f"Starting agent service with config: {config.model_dump()}")
-        AgentService(config).main()
+def preprocess_follow_test() -> None:
+    from application.bin.systemd_preprocessing_service.follow import run_follow
+    from application.dtos.preprocess_config import PreprocessConfig
+
+    feed_path = Path("data/game_events_feed.ndjson")
+
+    asyncio.run(run_follow(path=feed_path, config=PreprocessConfig(bulk_insert=True), stop_event=shutdown_event))
+
+
+def run_agent_service(
+    configs: list[AgentServiceConfig],
+    runtime_config: AgentRuntimeConfig | None = None,
+    sweep: bool = False,
+) -> None:
+    runtime_config = runtime_config or AgentRuntimeConfig()
+    if sweep:
+        ParameterSweep(configs, runtime_config).run()
+        return
+    if runtime_config.max_services > 1:
+        AgentRuntime(configs, runtime_config).run()
+        return
+
+    limits = ConcurrencyLimits(llm_calls=runtime_config.max_llm_calls, tts_calls=runtime_config.max_tts_calls)
+    metrics_path = runtime_config.metrics_path
+    with MetricsDumper(METRICS, metrics_path, runtime_config.metrics_interval_sec) if metrics_path else nullcontext():
+        for config in configs:
+            print(f"Starting agent service with config: {config.model_dump()}")
+            AgentService(config, limits=limits).main()
 
 
 if __name__ == "__main__":
@@ -1,9 +1,33 @@
 import os
+import random
+import threading
+import time
 from typing import Generator
 
-import boto3
+from botocore.exceptions import ClientError
 
+from application.aws_clients import AwsClients
+from application.hedging import HedgingStats, hedged_sentences
+from application.metrics import METRICS
 from application.models import ClaudeSonnet, ClaudeV2, Model, ModelID, NovaPro
+from application.retrieval_cache import RetrievalCache, normalize_query
+from application.tts_cache import TtsCache
+
+# the retrieval query is embedded, long game state dumps only dilute it
+RETRIEVAL_QUERY_MAX_CHARS = 1000
+# the region of the default model, Nova Pro, which the knowledge base was used with
+DEFAULT_KNOWLEDGE_BASE_REGION = "us-east-1"
+POLLY_THROTTLING_ERROR_CODES = ("ThrottlingException", "Throttling", "TooManyRequestsException")
+# everything besides the text that determines the synthesized audio, also part of the TTS cache key
+POLLY_VOICE_SETTINGS = {
+    "Engine": "generative",
+    "LanguageCode": "en-US",
+    "LexiconNames": [],
+    "OutputFormat": "mp3",
+    "SampleRate": "24000",
+    "TextType": "text",
+    "VoiceId": "Stephen",
+}
 
 
 class KnowledgeBase:
@@ -11,22 +35,62 @@ class KnowledgeBase:
         self.base_id = kwargs.get("base_id", os.getenv("KNOWLEDGE_BASE_ID"))
         self.bucket_name = kwargs.get("bucket_name", os.getenv("BUCKET_NAME"))
         self.data_source_id = kwargs.get("data_source_id", os.getenv("DATA_SOURCE_ID"))
+        # retrieval and retrieve_and_generate both go there, the latter with a model of the same region
+        self.region = kwargs.get("knowledge_base_region", os.getenv("KNOWLEDGE_BASE_REGION", DEFAULT_KNOWLEDGE_BASE_REGION))
 
 
 class AwsAPI:
 
     def __init__(self, **kwargs) -> None:
-        self.polly = boto3.client("polly")
+        self._polly = None
 
         self.models_mapping: dict[ModelID, Model] = {
             ModelID.NOVA_PRO: NovaPro(),
             ModelID.CLAUDE_V2: ClaudeV2(),
             ModelID.CLAUDE_SONNET: ClaudeSonnet(),
         }
-        self.s3 = boto3.client("s3")
+        self._s3 = None
+        self._bedrock_agent_runtime = None
         self.knowledge_base = KnowledgeBase(**kwargs)
+        # opt-in, e.g. output/tts_cache, no dir disables the cache
+        tts_cache_dir = kwargs.get("tts_cache_dir", os.getenv("TTS_CACHE_DIR", ""))
+        tts_cache_max_bytes = int(kwargs.get("tts_cache_max_bytes", os.getenv("TTS_CACHE_MAX_BYTES", 512 * 2**20)))
+        self.tts_cache = TtsCache(tts_cache_dir, tts_cache_max_bytes) if tts_cache_dir else None
+        self.hedging_stats = HedgingStats()
+        self.retrieval_cache = RetrievalCache(
+            ttl_sec=float(kwargs.get("retrieval_cache_ttl_sec", os.getenv("RETRIEVAL_CACHE_TTL_SEC", 300))),
+            max_entries=int(kwargs.get("retrieval_cache_max_entries", os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", 1024))),
+        )
+
+    @property
+    def polly(self):
+        if self._polly is None:
+            self._polly = AwsClients().get("polly")
+        return self._polly
+
+    @polly.setter
+    def polly(self, client) -> None:
+        self._polly = client
 
-        self.delays: list[float] = []
+    @property
+    def s3(self):
+        if self._s3 is None:
+            self._s3 = AwsClients().get("s3")
+        return self._s3
+
+    @s3.setter
+    def s3(self, client) -> None:
+        self._s3 = client
+
+    @property
+    def bedrock_agent_runtime(self):
+        if self._bedrock_agent_runtime is None:
+            self._bedrock_agent_runtime = AwsClients().get("bedrock-agent-runtime", self.knowledge_base.region)
+        return self._bedrock_agent_runtime
+
+    @bedrock_agent_runtime.setter
+    def bedrock_agent_runtime(self, client) -> None:
+        self._bedrock_agent_runtime = client
 
     def get_streamed_response(
         self,
@@ -36,11 +100,39 @@ class AwsAPI:
     ) -> Generator[str, None, None]:
         yield from self.models_mapping[model_id].get_streamed_response(messages, temperature)
 
-    def get_streamed_response_rag(self, model: Model, prompt: str) -> Generator[str, None, None]:
+    def get_hedged_streamed_response(
+        self,
+        primary_id: ModelID,
+        secondary_id: ModelID,
+        prompts: list[str],
+        temperature: float = 0.9,
+        hedge_percentile: float = 0.95,
+        hedge_min_samples: int = 10,
+        hedge_delay_sec: float = 2.0,
+    ) -> Generator[str, None, None]:
+        """
+        Hedges after the `hedge_percentile` of the primary's observed time to first sentence,
+        or after `hedge_delay_sec` until `hedge_min_samples` were observed.
+        """
+        time_to_first_sentence = METRICS.histogram("bedrock_time_to_first_sentence_seconds", model=primary_id.value)
+        hedge_after_sec = (
+            time_to_first_sentence.quantile(hedge_percentile) if time_to_first_sentence.count >= hedge_min_samples else hedge_delay_sec
+        )
+        yield from hedged_sentences(
+            self.models_mapping[primary_id],
+            self.models_mapping[secondary_id],
+            prompts,
+            temperature,
+            hedge_after_sec,
+            self.hedging_stats,
+        )
+
+    def get_streamed_response_rag(self, model: Model, prompt: str, number_of_results: int = 5) -> Generator[str, None, None]:
         """
         Note: looks like it's impossible to pass a list of prompts when using knowledge bases.
         """
-        bedrock_agent_runtime = boto3.client("bedrock-agent-runtime", region_name=model.region)
+        if model.region != self.knowledge_base.region:
+            raise ValueError(f"{model.model_id.value} runs in {model.region}, the knowledge base is in {self.knowledge_base.region}")
         knowledge_base_config = {
             "knowledgeBaseId": self.knowledge_base.base_id,
             "modelArn": model.arn,
@@ -48,12 +140,13 @@ class AwsAPI:
             "orchestrationConfiguration": {},
             "retrievalConfiguration": {
                 "vectorSearchConfiguration": {
-                    "numberOfResults": 5,
+                    "numberOfResults": number_of_results,
                 },
             },
         }
 
-        stream = bedrock_agent_runtime.retrieve_and_generate_stream(
+        started_at = time.perf_counter()
+        stream = self.bedrock_agent_runtime.retrieve_and_generate_stream(
             input={"text": prompt},
             retrieveAndGenerateConfiguration={
                 "type": "KNOWLEDGE_BASE",
@@ -62,37 +155,82 @@ class AwsAPI:
         )
         model = self.models_mapping[model.model_id]
         yield from model.generate_sentences_from_stream(
-            stream_body=stream["stream"], text_getter=lambda chunk: chunk.get("output", {}).get("text", "")
+            stream_body=stream["stream"], text_getter=lambda chunk: chunk.get("output", {}).get("text", ""), started_at=started_at
         )
 
+    def retrieve(self, query: str, number_of_results: int = 5) -> list[dict]:
+        """
+        Knowledge base passages for the query, from the retrieval cache when a query of the same normalized form was seen.
+        """
+        key = (self.knowledge_base.base_id, number_of_results, normalize_query(query, RETRIEVAL_QUERY_MAX_CHARS))
+        passages = self.retrieval_cache.get(key)
+        if passages is not None:
+            return passages
+        with METRICS.timer("bedrock_retrieve_seconds"):
+            response = self.bedrock_agent_runtime.retrieve(
+                knowledgeBaseId=self.knowledge_base.base_id,
+                retrievalQuery={"text": query[:RETRIEVAL_QUERY_MAX_CHARS]},
+                retrievalConfiguration={"vectorSearchConfiguration": {"numberOfResults": number_of_results}},
+            )
+        passages = [{"text": result["content"]["text"], "score": result.get("score")} for result in response["retrievalResults"]]
+        self.retrieval_cache.put(key, passages)
+        return passages
+
+    def augment_with_passages(self, prompt: str, number_of_results: int = 5, query: str | None = None) -> str:
+        """
+        Split retrieve-then-generate RAG. Unlike retrieve_and_generate_stream, this keeps the dialogue history,
+        and with cached passages a tick costs a single LLM round trip. The knowledge base is searched for
+        `query`, the prompt itself when there's none.
+        """
+        passages = self.retrieve(prompt if query is None else query, number_of_results)
+        if not passages:
+            return prompt
+        background = "\n".join(f"- {passage['text']}" for passage in passages)
+        return f"Background from the game knowledge base, use it only where relevant:\n{background}\n\n{prompt}"
+
     def get_bedrock_stats(self, model_id: ModelID) -> str:
-        model = self.models_mapping[model_id]
-        deltas = [model.delays[0]] + [model.delays[i] - model.delays[i - 1] for i in range(1, len(model.delays))]
-        average_got_sentence_time = sum(deltas) / len(model.delays)
-        min_got_sentence_time, max_got_sentence_time = min(deltas), max(deltas)
-        model.delays.clear()
-        return f"1 sentence generation latencies: avg={average_got_sentence_time:.2f}sec, min={min_got_sentence_time:.2f}sec, max={max_got_sentence_time:.2f}sec"
-
-    def convert_to_voice(self, response_text: str, filename: str) -> None:
-        response = self.polly.synthesize_speech(
-            Engine="generative",
-            LanguageCode="en-US",
-            LexiconNames=[],
-            OutputFormat="mp3",
-            SampleRate="24000",
-            Text=response_text,
-            TextType="text",
-            VoiceId="Stephen",
+        labels = {"model": model_id.value}
+        return "\n".join(
+            (
+                METRICS.histogram("bedrock_time_to_first_token_seconds", **labels).summary("Time to first token"),
+                METRICS.histogram("bedrock_sentence_gap_seconds", **labels).summary("1 sentence generation latencies"),
+            )
         )
-        with open(filename, "wb") as file:
-            body = response["AudioStream"]
-            for b in body:
-                file.write(b)
+
+    def synthesize_speech(self, response_text: str, max_retries: int = 4, backoff_base_sec: float = 0.2) -> dict:
+        """
+        Retries throttled calls with exponential backoff and full jitter, concurrent synthesis hits the Polly TPS limit.
+        """
+        for attempt in range(max_retries + 1):
+            try:
+                return self.polly.synthesize_speech(Text=response_text, **POLLY_VOICE_SETTINGS)
+            except ClientError as err:
+                if err.response.get("Error", {}).get("Code") not in POLLY_THROTTLING_ERROR_CODES or attempt == max_retries:
+                    raise
+                time.sleep(random.uniform(0, backoff_base_sec * 2**attempt))
+
+    def convert_to_voice(self, response_text: str, filename: str, max_retries: int = 4) -> bool:
+        """
+        Returns True when the audio came from the TTS cache instead of Polly.
+        """
+        if self.tts_cache and self.tts_cache.fetch(response_text, POLLY_VOICE_SETTINGS, filename):
+            return True
+        # the audio streams in after the response headers, so a call lasts until it's written out
+        with METRICS.timer("polly_call_seconds"):
+            response = self.synthesize_speech(response_text, max_retries=max_retries)
+            # a new file replaces the old one, a retried tick never writes into earlier audio
+            tmp_filename = f"{filename}.{threading.get_ident()}.tmp"
+            with open(tmp_filename, "wb") as file:
+                body = response["AudioStream"]
+                for b in body:
+                    file.write(b)
+            os.replace(tmp_filename, filename)
+        if self.tts_cache:
+            self.tts_cache.store(response_text, POLLY_VOICE_SETTINGS, filename)
+        return False
 
     def get_polly_stats(self) -> str:
-        average_saved_audio_time = sum(self.delays) / len(self.delays)
-        min_saved_audio_time, max_saved_audio_time = min(self.delays), max(self.delays)
-        # self.delays.clear()
-        return (
-            f"Polly latencies: avg={average_saved_audio_time:.2f}sec, min={min_saved_audio_time:.2f}sec, max={max_saved_audio_time:.2f}sec"
-        )
+        return METRICS.histogram("polly_call_seconds").summary("Polly latencies")
+
+    def get_tts_cache_stats(self) -> str:
+        return self.tts_cache.get_stats() if self.tts_cache else "TTS cache: disabled"
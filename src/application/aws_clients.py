@@ -0,0 +1,44 @@
+import os
+import threading
+
+import boto3
+from botocore.config import Config
+
+# boto3 keeps 10 connections per client by default, concurrent agent services and TTS threads share the clients
+MAX_POOL_CONNECTIONS = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", 50))
+CLIENT_CONFIG = Config(max_pool_connections=MAX_POOL_CONNECTIONS, tcp_keepalive=True)
+
+
+class AwsClients:
+    """
+    Process-wide boto3 clients, one per (service, region), created on first use from a single session.
+    Clients are thread-safe and keep their pooled connections alive between calls, creating them is not
+    (and costs tens of milliseconds), so it happens under a lock and only once.
+    """
+
+    _instance = None
+    _lock = threading.Lock()
+
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._lock:
+                if cls._instance is None:
+                    cls._instance = super(AwsClients, cls).__new__(cls)
+                    cls._instance._initialize()
+        return cls._instance
+
+    def _initialize(self) -> None:
+        self.session: boto3.session.Session | None = None
+        self.clients: dict[tuple[str, str | None], object] = {}
+
+    def get(self, service: str, region: str | None = None):
+        key = (service, region)
+        client = self.clients.get(key)
+        if client is not None:
+            return client
+        with self._lock:
+            if key not in self.clients:
+                if self.session is None:
+                    self.session = boto3.session.Session()
+                self.clients[key] = self.session.client(service, region_name=region, config=CLIENT_CONFIG)
+            return self.clients[key]
@@ -0,0 +1,141 @@
+"""
+End-to-end agent service latency without AWS: replays a stored match from agent_db.sqlite through
+AgentService.main with the Bedrock and Polly clients swapped for local fakes, and reports per-stage timings.
+
+Everything but the network calls runs as in production, so the LLM and TTS stages show the configured
+fake latencies plus our own overhead, and the remaining stages are entirely ours.
+Run from src/: python -m application.benchmarks.agent_pipeline [--start TS --end TS --pipelined ...]
+"""
+
+import argparse
+import time
+from collections import defaultdict
+
+from sqlalchemy import func, select
+
+from application.bin.systemd_agent_service import agent_service as agent_service_module
+from application.bin.systemd_agent_service.agent_service import AgentService
+from application.db_models import DatabaseConnection, GameState
+from application.dtos.agent_service_config import AgentServiceConfig, InitPrompts, Trait
+from application.dtos.fake_aws_config import FakeAwsConfig, LatencyDistribution
+from application.fake_aws import make_fake_aws
+from application.metrics import METRICS
+from application.models import ModelID
+
+STAGES = {
+    "get_snapshots": "window query",
+    "compose_prompt": "prompt composition",
+    "_trim_queue": "context trimming",
+    "generate_response": "LLM generation",
+    "generate_audios": "TTS",
+    "generate_response_with_audios": "LLM + TTS pipelined",
+}
+
+
+class StageTimer:
+    def __init__(self) -> None:
+        self.durations: dict[str, list[float]] = defaultdict(list)
+
+    def wrap(self, name: str, method):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.durations[name].append(time.perf_counter() - start)
+
+        return timed
+
+    def instrument(self, service: AgentService) -> None:
+        for method_name, stage in STAGES.items():
+            setattr(service, method_name, self.wrap(stage, getattr(service, method_name)))
+        # the dialogue file appends happen in main through the module level helper
+        agent_service_module.dump_str_to_file = self.wrap("dialogue writes", agent_service_module.dump_str_to_file)
+
+    def report(self, wall_sec: float) -> None:
+        print(f"{'stage':<22} {'calls':>6} {'total, s':>9} {'avg, ms':>9} {'min, ms':>9} {'max, ms':>9}")
+        for stage, durations in self.durations.items():
+            total = sum(durations)
+            print(
+                f"{stage:<22} {len(durations):>6} {total:>9.3f} {total / len(durations) * 1000:>9.2f} "
+                f"{min(durations) * 1000:>9.2f} {max(durations) * 1000:>9.2f}"
+            )
+        print(f"{'wall clock':<22} {'':>6} {wall_sec:>9.3f}")
+
+
+def get_match_bounds(db: DatabaseConnection) -> tuple[int, int]:
+    with db.engine.connect() as connection:
+        start, end = connection.execute(select(func.min(GameState.event_created_at), func.max(GameState.event_created_at))).one()
+    if start is None:
+        raise SystemExit("agent_db.sqlite holds no game states, run the preprocessing first")
+    return int(start), int(end) + 1
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--start", type=int, help="match start timestamp, defaults to the first stored event")
+    parser.add_argument("--end", type=int, help="match end timestamp, defaults to the last stored event")
+    parser.add_argument("--interval", type=int, default=10, help="query interval, sec")
+    parser.add_argument("--model", choices=[model_id.name for model_id in ModelID], default=ModelID.NOVA_PRO.name)
+    parser.add_argument("--pipelined", action="store_true", help="pipeline generated sentences into TTS")
+    parser.add_argument("--compact", action="store_true", help="use compact prompts")
+    parser.add_argument("--ttft", type=float, default=0.6, help="mean fake time to first token, sec")
+    parser.add_argument("--chunk-delay", type=float, default=0.03, help="mean fake inter-chunk delay, sec")
+    parser.add_argument("--tts", type=float, default=0.35, help="mean fake Polly latency, sec")
+    parser.add_argument("--spike-probability", type=float, default=0, help="chance of a fake TTFT spike of the primary model")
+    parser.add_argument("--spike", type=float, default=0, help="fake TTFT spike, sec")
+    parser.add_argument("--hedge-model", choices=[model_id.name for model_id in ModelID], help="hedge the primary model with this one")
+    parser.add_argument("--hedge-percentile", type=float, default=0.95, help="of the primary's time to first sentence")
+    parser.add_argument("--rag", choices=["off", "split"], default="off", help="retrieve-then-generate with the retrieval cache")
+    parser.add_argument("--retrieval", type=float, default=0.3, help="mean fake knowledge base retrieval latency, sec")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--metrics-path", help="also dump the latency histograms, JSON or Prometheus text for a .prom path")
+    args = parser.parse_args()
+
+    fake_config = FakeAwsConfig(
+        time_to_first_token=LatencyDistribution(mean_sec=args.ttft, stddev_sec=args.ttft / 4),
+        inter_chunk_delay=LatencyDistribution(mean_sec=args.chunk_delay, stddev_sec=args.chunk_delay / 3),
+        tts_latency=LatencyDistribution(mean_sec=args.tts, stddev_sec=args.tts / 4),
+        retrieval_latency=LatencyDistribution(mean_sec=args.retrieval, stddev_sec=args.retrieval / 4),
+        seed=args.seed,
+    )
+    # only the primary gets the spikes, the hedge is an equally fast model without them
+    primary_config = fake_config.model_copy(
+        update={
+            "time_to_first_token": fake_config.time_to_first_token.model_copy(
+                update={"spike_probability": args.spike_probability, "spike_sec": args.spike}
+            ),
+            "seed": args.seed + 1,
+        }
+    )
+    start, end = get_match_bounds(DatabaseConnection())
+    config = AgentServiceConfig(
+        init_prompts=InitPrompts(traits=[Trait(name="excited", value=80)]),
+        game_start_timestamp=args.start or start,
+        game_end_timestamp=args.end or end,
+        query_interval_sec=args.interval,
+        model_id=ModelID[args.model],
+        pipelined_tts=args.pipelined,
+        compact_prompts=args.compact,
+        hedge_model_id=ModelID[args.hedge_model] if args.hedge_model else None,
+        hedge_percentile=args.hedge_percentile,
+        rag=args.rag,
+    )
+
+    service = AgentService(config, aws=make_fake_aws(fake_config, {config.model_id: primary_config}))
+    timer = StageTimer()
+    timer.instrument(service)
+    started_at = time.perf_counter()
+    service.main()
+    wall_sec = time.perf_counter() - started_at
+
+    print()
+    timer.report(wall_sec)
+    if service.first_audio_delays.count:
+        print(service.get_first_audio_stats())
+    if args.metrics_path:
+        METRICS.dump(args.metrics_path)
+
+
+if __name__ == "__main__":
+    main()
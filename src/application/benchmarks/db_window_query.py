@@ -0,0 +1,76 @@
+"""
+Tick latency of the agent service window query against game_states table size.
+
+Compares the old two-range-scan query on an unindexed table with the single combined query
+on the indexed table. Run from src/: python -m application.benchmarks.db_window_query
+"""
+
+import json
+import os
+import tempfile
+import time
+
+from sqlalchemy import and_, create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from application.bin.systemd_agent_service.utils import get_game_states_window
+from application.db_models import Base, GameState
+
+TABLE_SIZES = (1_000, 10_000, 100_000, 500_000)
+TICKS = 200
+SAMPLES_PER_SEC = 10
+PAST_WINDOW_SIZE_SEC = 3
+FUTURE_WINDOW_SIZE_SEC = 1
+EVENT_DATA = json.dumps({"created_at": 0, "players": [{"user_id": "1234", "hit_points": 78, "shield": 15, "shot_list": []}]})
+
+
+def two_queries(session: Session, window_start: float, future_start: float, window_end: float) -> tuple[list, list]:
+    past = (
+        session.query(GameState).filter(and_(GameState.event_created_at >= window_start, GameState.event_created_at < future_start)).all()
+    )
+    future = (
+        session.query(GameState).filter(and_(GameState.event_created_at >= future_start, GameState.event_created_at < window_end)).all()
+    )
+    return past, future
+
+
+def make_session(path: str, table_size: int, indexed: bool) -> Session:
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+    if not indexed:
+        for index in GameState.__table__.indexes:
+            index.drop(bind=engine)
+    with engine.begin() as connection:
+        connection.execute(
+            GameState.__table__.insert(),
+            [{"event_id": str(i), "event_created_at": i // SAMPLES_PER_SEC, "event_data": EVENT_DATA} for i in range(table_size)],
+        )
+    return sessionmaker(bind=engine)()
+
+
+def measure_tick_ms(session: Session, query, table_size: int) -> float:
+    duration_sec = table_size // SAMPLES_PER_SEC
+    step = max(duration_sec // TICKS, 1)
+    timestamps = [(i * step) % duration_sec for i in range(TICKS)]
+    start = time.perf_counter()
+    for timestamp in timestamps:
+        future_start = timestamp + PAST_WINDOW_SIZE_SEC
+        query(session, timestamp, future_start, future_start + FUTURE_WINDOW_SIZE_SEC)
+        session.expunge_all()
+    return (time.perf_counter() - start) / TICKS * 1000
+
+
+def main() -> None:
+    print(f"{'rows':>10} {'before, ms/tick':>16} {'after, ms/tick':>16}")
+    for table_size in TABLE_SIZES:
+        results = []
+        for indexed, query in ((False, two_queries), (True, get_game_states_window)):
+            with tempfile.TemporaryDirectory() as folder:
+                session = make_session(os.path.join(folder, "bench.sqlite"), table_size, indexed)
+                results.append(measure_tick_ms(session, query, table_size))
+                session.close()
+        print(f"{table_size:>10} {results[0]:>16.3f} {results[1]:>16.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Regression check of the preprocessing dedup: ingests a group event holding the same sample twice, then
+the same event again with a wider and a narrower player focus, through both writers into a scratch agent_db.sqlite.
+Every run has to store each sample once, with the players of the latest focus in both tables.
+Run from src/: python -m application.benchmarks.ingest_dedup
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from sqlalchemy import select
+
+from application.bin.systemd_preprocessing_service.preprocess_v2 import run_preprocess
+from application.db_models import DatabaseConnection, GameState, PlayerState
+from application.dtos.preprocess_config import PreprocessConfig
+from application.payload_codecs import decode_event_data
+
+PLAYERS = [
+    {"user_id": user_id, "character": "Sample Character", "hit_points": 100, "shield": 50, "current_states": ["alive"], "shot_list": []}
+    for user_id in ("player-1", "player-2")
+]
+SAMPLE = {"timestamp": 1672531200, "players": PLAYERS}
+GROUP_EVENT = {"event_identifier": "GameStateGroupGameEvent", "event_data": {"samples": [SAMPLE, SAMPLE]}}
+
+
+def stored_players(db: DatabaseConnection) -> tuple[int, list[str], list[str]]:
+    """Number of game_states rows, then the user ids in the snapshot payloads and in player_states."""
+    with db.engine.connect() as connection:
+        events = connection.execute(select(GameState.event_codec, GameState.event_data, GameState.event_payload)).all()
+        player_states = connection.execute(select(PlayerState.user_id).order_by(PlayerState.user_id)).scalars().all()
+    snapshot_players = sorted(player["user_id"] for event in events for player in decode_event_data(event)["players"])
+    return len(events), snapshot_players, player_states
+
+
+def main() -> None:
+    src_path = Path.cwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        db = DatabaseConnection()
+        try:
+            dump_path = Path(tmp_dir) / "dump.json"
+            dump_path.write_text(json.dumps(GROUP_EVENT))
+            for bulk_insert in (False, True):
+                with db.engine.begin() as connection:
+                    connection.execute(PlayerState.__table__.delete())
+                    connection.execute(GameState.__table__.delete())
+                for focused_user_ids in (["player-1"], "all", ["player-2"]):
+                    config = PreprocessConfig(bulk_insert=bulk_insert, focused_user_ids=focused_user_ids, resolve_nicknames=False)
+                    asyncio.run(run_preprocess(dump_path, config))
+                    stored = stored_players(db)
+                    expected_players = sorted(config.get_focused_user_ids() or [player["user_id"] for player in PLAYERS])
+                    print(f"bulk_insert={bulk_insert}, focused_user_ids={focused_user_ids}: stored {stored}")
+                    assert stored == (1, expected_players, expected_players), f"expected 1 sample of {expected_players}, got {stored}"
+        finally:
+            db.engine.dispose()
+            os.chdir(src_path)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
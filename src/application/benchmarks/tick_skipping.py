@@ -0,0 +1,78 @@
+"""
+Regression check of the empty tick skipping: stores a sparse match in a scratch agent_db.sqlite and replays
+the ticks through the window cache and the sweep store for past windows shorter and longer than the query
+interval. Every tick whose past window holds a snapshot has to be run, no others.
+Run from src/: python -m application.benchmarks.tick_skipping
+"""
+
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from application.bin.systemd_agent_service.window_cache import (
+    GameStateWindowCache,
+    SweepWindowStore,
+    next_nonempty_tick,
+)
+from application.db_models import DatabaseConnection, GameState
+
+START = 1000
+END = 3000
+SNAPSHOT_TIMESTAMPS = (1001, 1002, 1296, 1297, 1600, 2020, 2770, 2771, 2999)
+# (past_window_size_sec, query_interval_sec)
+WINDOWS = ((12, 5), (11, 10), (3, 10), (10, 10), (25, 7), (1, 1))
+CHUNK_SECS = (7, 60, 1000)
+EVENT_DATA = json.dumps({"created_at": 0, "players": []})
+
+
+def expected_ticks(past_window_sec: int, interval: int) -> list[int]:
+    return [
+        tick
+        for tick in range(START, END, interval)
+        if any(tick <= created_at < tick + past_window_sec for created_at in SNAPSHOT_TIMESTAMPS)
+    ]
+
+
+def replay_ticks(window_source: GameStateWindowCache | SweepWindowStore, past_window_sec: int, interval: int) -> list[int]:
+    """The ticks AgentService.main runs, a tick with an empty past window skips ahead."""
+    ticks = []
+    tick = START
+    while tick < END:
+        past, _ = window_source.get_window(tick, tick + past_window_sec, tick + past_window_sec)
+        if past:
+            ticks.append(tick)
+            tick += interval
+        else:
+            tick = next_nonempty_tick(window_source, tick + interval, interval, past_window_sec, END)
+    return ticks
+
+
+def main() -> None:
+    src_path = Path.cwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.chdir(tmp_dir)
+        db = DatabaseConnection()
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(
+                    GameState.__table__.insert(),
+                    [{"event_created_at": created_at, "event_data": EVENT_DATA} for created_at in SNAPSHOT_TIMESTAMPS],
+                )
+            for past_window_sec, interval in WINDOWS:
+                expected = expected_ticks(past_window_sec, interval)
+                window_sources = [SweepWindowStore(db, START, END)] + [GameStateWindowCache(db, chunk_sec) for chunk_sec in CHUNK_SECS]
+                for window_source in window_sources:
+                    ticks = replay_ticks(window_source, past_window_sec, interval)
+                    assert (
+                        ticks == expected
+                    ), f"past={past_window_sec}, interval={interval}, {type(window_source).__name__}: {ticks} != {expected}"
+                print(f"past={past_window_sec}, interval={interval}: {len(expected)} ticks run")
+        finally:
+            db.engine.dispose()
+            os.chdir(src_path)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
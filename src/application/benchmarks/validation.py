@@ -0,0 +1,60 @@
+"""
+Group event validation throughput of the dict paths run_preprocess can take and of parsing JSON bytes.
+
+The events are built from data/playground.json, normalized to the current schema
+(`current_state` -> `current_states`) and replicated to a match-sized dump.
+Run from src/: python -m application.benchmarks.validation
+"""
+
+import json
+import time
+from pathlib import Path
+
+from application.bin.account_service.account_container import AccountContainer
+from application.dtos.game_state_event import (
+    NICKNAMES_CONTEXT_KEY,
+    GameStateGroupGameEvent,
+)
+
+DATA_FOLDER_PATH = Path("data")
+GROUP_EVENTS = 500
+SAMPLES_PER_GROUP = 10
+
+
+def load_sample_events() -> list[dict]:
+    with open(DATA_FOLDER_PATH / "playground.json") as f:
+        group_event = json.load(f)
+    sample = group_event["event_data"]["samples"][0]
+    for player in sample["players"]:
+        player["current_states"] = [player.pop("current_state")]
+
+    events = []
+    for i in range(GROUP_EVENTS):
+        samples = [{**sample, "timestamp": sample["timestamp"] + i * SAMPLES_PER_GROUP + j} for j in range(SAMPLES_PER_GROUP)]
+        events.append({**group_event, "event_data": {**group_event["event_data"], "samples": samples}})
+    return events
+
+
+def measure(name: str, func) -> None:
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<40} {GROUP_EVENTS / elapsed:>12.0f} events/sec")
+
+
+def main() -> None:
+    AccountContainer(file_path=DATA_FOLDER_PATH / "user_nicknames.json")
+    events = load_sample_events()
+    events_json = [json.dumps(event).encode() for event in events]
+
+    measure("GameStateGroupGameEvent(**dict)", lambda: [GameStateGroupGameEvent(**event) for event in events])
+    measure(
+        "model_validate, nicknames deferred",
+        lambda: [GameStateGroupGameEvent.model_validate(event, context={NICKNAMES_CONTEXT_KEY: False}) for event in events],
+    )
+    measure("json.loads + GameStateGroupGameEvent", lambda: [GameStateGroupGameEvent(**json.loads(event)) for event in events_json])
+    measure("model_validate_json per event", lambda: [GameStateGroupGameEvent.model_validate_json(event) for event in events_json])
+
+
+if __name__ == "__main__":
+    main()
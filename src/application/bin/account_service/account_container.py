@@ -30,6 +30,10 @@ class AccountContainer:
                 except (json.JSONDecodeError, KeyError):
                     self._user_map = {}
 
+    @property
+    def file_path(self):
+        return getattr(self, "_file_path", None)
+
     def get_nick(self, user_id, default=None):
         """Retrieves the nick for the given user ID."""
         return self._user_map.get(user_id, default)
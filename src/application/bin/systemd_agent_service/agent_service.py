@@ -1,32 +1,81 @@
+import glob
+import itertools
 import json
+import math
 import os
 import time
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import Generator
 
-from sqlalchemy import and_
 from sqlalchemy.orm import Session
 
 from application.aws import AwsAPI
+from application.bin.systemd_agent_service.compact_prompt import (
+    compose_compact_prompt_from_snapshots,
+)
+from application.bin.systemd_agent_service.limits import ConcurrencyLimits
 from application.bin.systemd_agent_service.utils import (
-    compose_prompt_from_events,
+    build_retrieval_query,
+    compose_prompt_from_snapshots,
+    decode_snapshot,
     dump_dialogue_json,
     dump_str_to_file,
+    get_game_states_window,
+    get_player_states_window,
+)
+from application.bin.systemd_agent_service.window_cache import (
+    GameStateWindowCache,
+    SharedPromptCache,
+    SweepWindowStore,
+    next_nonempty_tick,
 )
 from application.db_models import DatabaseConnection, GameState
 from application.dtos.agent_service_config import AgentServiceConfig
+from application.metrics import METRICS, SIZE_BUCKET_BOUNDS, StreamingHistogram
+from application.utils import estimate_tokens, trim_queue
 
 
 class AgentService:
-    def __init__(self, config: AgentServiceConfig) -> None:
+    def __init__(
+        self,
+        config: AgentServiceConfig,
+        aws: AwsAPI | None = None,
+        limits: ConcurrencyLimits | None = None,
+        window_cache: GameStateWindowCache | SweepWindowStore | None = None,
+        prompt_cache: SharedPromptCache | None = None,
+    ) -> None:
         self.config = config
-        self.aws = AwsAPI()
+        self.aws = aws or AwsAPI()
+        self.limits = limits or ConcurrencyLimits()
         self.db = DatabaseConnection()
+        # live windows sit at the newest rows, which the cache would query again on every tick anyway
+        if window_cache is None and self.config.prefetch_chunk_sec and not self.config.live and not self.config.focused_user_ids:
+            window_cache = GameStateWindowCache(self.db, self.config.prefetch_chunk_sec)
+        self.window_cache = window_cache
+        self.prompt_cache = prompt_cache
         self.dialogue_path, self.audio_path = self.make_output_paths()
 
         self.base_timestamp = self.config.game_start_timestamp
-        self.q = deque(self.config.init_prompts.to_list())
+        self.tick_started_at = time.time()
+        # split RAG, what the knowledge base is searched for on the current tick
+        self.retrieval_query: str | None = None
+        # time from the start of response generation until the tick's first mp3 file is written
+        self.first_audio_delays = StreamingHistogram()
+        # this service's own samples, the process-wide METRICS are shared between services
+        self.generation_delays = StreamingHistogram()
+        self.audio_delays = StreamingHistogram()
+        # sentences served from the TTS cache, kept apart so they don't pass for fast Polly calls
+        self.audio_cache_hit_delays = StreamingHistogram()
+        self.prompt_sizes = StreamingHistogram(SIZE_BUCKET_BOUNDS)
+        # live mode, lag of a tick's start behind the game clock
+        self.live_lag = StreamingHistogram()
+        self.live_started_at = self.config.live_start_at
+        self.skipped_ticks = 0
+        self.deadline_misses = 0
+        self.failed_ticks = 0
+        self.q = deque(self.config.get_init_prompts())
         self.dialogue = [
             {"role": role, "message": message, "timestamp": self.config.game_start_timestamp}
             for role, message in zip(("User", "Assistant"), (self.q[-2], self.q[-1]))
@@ -41,113 +90,321 @@ class AgentService:
 
     def make_output_paths(self) -> tuple[str, str]:
         human_readable_timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        audio_path = f"output/audio/{human_readable_timestamp}"
-        dialogue_path = f"output/text/{human_readable_timestamp}"
-        for path in (audio_path, dialogue_path):
-            if not os.path.exists(path):
-                os.makedirs(path)
-
-        return dialogue_path, audio_path
+        # services started concurrently within the same second get numbered folders
+        for i in itertools.count():
+            folder = human_readable_timestamp if i == 0 else f"{human_readable_timestamp}-{i}"
+            audio_path = f"output/audio/{folder}"
+            dialogue_path = f"output/text/{folder}"
+            try:
+                os.makedirs(audio_path)
+            except FileExistsError:
+                continue
+            os.makedirs(dialogue_path, exist_ok=True)
+            return dialogue_path, audio_path
 
     def get_sentences(self) -> Generator[str, None, None]:
-        roles = ("user", "assistant")
-        model = self.aws.models_mapping[self.config.model_id]
-
-        messages = [
-            {
-                "role": roles[i % 2],
-                "content": [model.get_content(prompt)],
-            }
-            for i, prompt in enumerate(self.q)
-        ]
-        yield from self.aws.get_streamed_response(self.config.model_id, messages, self.config.temperature)
+        # a hedge runs within the same slot, it replaces the primary request rather than adding a tick
+        prompts = list(self.q)
+        if self.config.rag == "split":
+            # the passages only go to this request, the dialogue history keeps the plain prompt
+            prompts[-1] = self.aws.augment_with_passages(prompts[-1], self.config.rag_results, self.retrieval_query)
+        with self.limits.llm_calls:
+            if self.config.rag == "retrieve_and_generate":
+                model = self.aws.models_mapping[self.config.model_id]
+                yield from self.aws.get_streamed_response_rag(model, prompts[-1], self.config.rag_results)
+                return
+            if self.config.hedge_model_id is None:
+                messages = self.aws.models_mapping[self.config.model_id].get_messages(prompts)
+                yield from self.aws.get_streamed_response(self.config.model_id, messages, self.config.temperature)
+                return
+            yield from self.aws.get_hedged_streamed_response(
+                self.config.model_id,
+                self.config.hedge_model_id,
+                prompts,
+                self.config.temperature,
+                hedge_percentile=self.config.hedge_percentile,
+                hedge_min_samples=self.config.hedge_min_samples,
+                hedge_delay_sec=self.config.hedge_delay_sec,
+            )
 
     def generate_response(self) -> list[str]:
         current_timestamp = time.time()
+        self.tick_started_at = current_timestamp
         response = []
 
         for sentence in self.get_sentences():
             response.append(sentence)
-        self.aws.models_mapping[self.config.model_id].delays.append(time.time() - current_timestamp)
+        self.add_generation_delay(time.time() - current_timestamp)
 
         return response
 
-    def generate_audios(self, response: list[str]) -> None:
-        audio_delays = []
-        for i, sentence in enumerate(response):
+    def add_generation_delay(self, delay: float) -> None:
+        METRICS.observe("bedrock_generation_seconds", delay, model=self.config.model_id.value)
+        self.generation_delays.observe(delay)
+
+    def add_audio_delays(self, delays: list[tuple[float, bool]]) -> None:
+        for delay, cached in delays:
+            (self.audio_cache_hit_delays if cached else self.audio_delays).observe(delay)
+
+    def synthesize_sentence(self, sentence: str, i: int) -> tuple[float, bool]:
+        """
+        Returns how long the sentence took and whether it came from the TTS cache.
+        """
+        audio_filename = f"{self.audio_path}/{self.base_timestamp}-{i + 1}.mp3"
+        with self.limits.tts_calls:
             current_timestamp = time.time()
-            audio_filename = f"{self.audio_path}/{self.base_timestamp}-{i + 1}.mp3"
-            self.aws.convert_to_voice(sentence, audio_filename)
-            audio_delays.append(time.time() - current_timestamp)
-        self.aws.delays = audio_delays
-
-    def get_events_from_db(self, session: Session) -> tuple[list[GameState], list[GameState]]:
-        past_events: list[GameState] = (
-            session.query(GameState)
-            .filter(
-                and_(
-                    GameState.event_created_at >= self.base_timestamp,
-                    GameState.event_created_at < self.base_timestamp + self.config.past_window_size_sec,
-                )
-            )
-            .all()
+            cached = self.aws.convert_to_voice(sentence, audio_filename, max_retries=self.config.tts_max_retries)
+        if i == 0:
+            self.first_audio_delays.observe(time.time() - self.tick_started_at)
+        return time.time() - current_timestamp, cached
+
+    def remove_tick_audios(self) -> None:
+        """
+        Deletes the audio files a failed attempt left for the current tick, a retry may produce fewer sentences
+        and a skipped tick none, stale files would still be played.
+        """
+        for filename in glob.glob(f"{self.audio_path}/{self.base_timestamp}-*.mp3"):
+            os.remove(filename)
+
+    def generate_audios(self, response: list[str]) -> None:
+        """
+        Synthesizes all sentences concurrently, at most tts_concurrency Polly calls at a time,
+        each into its own `<timestamp>-<i>.mp3` file. Delays are kept in sentence order.
+        """
+        with ThreadPoolExecutor(max_workers=self.config.tts_concurrency) as executor:
+            futures = [executor.submit(self.synthesize_sentence, sentence, i) for i, sentence in enumerate(response)]
+            self.add_audio_delays([future.result() for future in futures])
+
+    def generate_response_with_audios(self) -> list[str]:
+        """
+        Pipelined mode, each sentence goes to Polly as soon as it's generated while the rest of the
+        response is still streaming, so the first audio doesn't wait for the whole generation.
+        """
+        current_timestamp = time.time()
+        self.tick_started_at = current_timestamp
+        response = []
+
+        with ThreadPoolExecutor(max_workers=self.config.tts_concurrency) as executor:
+            futures = []
+            for i, sentence in enumerate(self.get_sentences()):
+                response.append(sentence)
+                futures.append(executor.submit(self.synthesize_sentence, sentence, i))
+            self.add_generation_delay(time.time() - current_timestamp)
+            self.add_audio_delays([future.result() for future in futures])
+
+        return response
+
+    def get_events_from_db(self, session: Session, window_start: float) -> tuple[list[GameState], list[GameState]]:
+        future_start = self.base_timestamp + self.config.past_window_size_sec
+        return get_game_states_window(
+            session,
+            window_start=window_start,
+            future_start=future_start,
+            window_end=future_start + self.config.future_window_size_sec,
         )
-        future_events: list[GameState] = (
-            session.query(GameState)
-            .filter(
-                and_(
-                    GameState.event_created_at >= self.base_timestamp + self.config.past_window_size_sec,
-                    GameState.event_created_at
-                    < self.base_timestamp + self.config.past_window_size_sec + self.config.future_window_size_sec,
-                )
+
+    def get_snapshots(self, session: Session, window_start: float | None = None) -> tuple[list[dict], list[dict]]:
+        """
+        `window_start` before base_timestamp widens the past window, live mode merges stale ticks that way.
+        """
+        with METRICS.timer("agent_window_query_seconds"):
+            return self._get_snapshots(session, self.base_timestamp if window_start is None else window_start)
+
+    def _get_snapshots(self, session: Session, window_start: float) -> tuple[list[dict], list[dict]]:
+        if self.config.focused_user_ids:
+            future_start = self.base_timestamp + self.config.past_window_size_sec
+            return get_player_states_window(
+                session,
+                self.config.focused_user_ids,
+                window_start=window_start,
+                future_start=future_start,
+                window_end=future_start + self.config.future_window_size_sec,
             )
-            .all()
+        if self.window_cache is None:
+            past_events, future_events = self.get_events_from_db(session, window_start)
+            return [decode_snapshot(event) for event in past_events], [decode_snapshot(event) for event in future_events]
+
+        future_start = self.base_timestamp + self.config.past_window_size_sec
+        return self.window_cache.get_window(window_start, future_start, future_start + self.config.future_window_size_sec)
+
+    def get_game_clock(self) -> float:
+        return self.config.game_start_timestamp + (time.time() - self.live_started_at) * self.config.live_speed
+
+    def wait_for_tick(self) -> float:
+        """
+        Live mode, waits until the game clock passes the end of the tick's future window. A tick that's
+        already later than the deadline is given up, base_timestamp jumps to the first tick that can still
+        make it, and with `stale_ticks="merge"` the skipped windows (up to max_merged_ticks) are folded into
+        its past window. Returns the past window start.
+        """
+        interval = self.config.query_interval_sec
+        deadline = self.config.query_interval_sec if self.config.tick_deadline_sec is None else self.config.tick_deadline_sec
+        due = self.base_timestamp + self.config.past_window_size_sec + self.config.future_window_size_sec
+        lag = self.get_game_clock() - due
+        window_start = self.base_timestamp
+
+        if lag > deadline:
+            missed = math.ceil((lag - deadline) / interval)
+            self.deadline_misses += 1
+            self.skipped_ticks += missed
+            print(f"Timestamp {self.base_timestamp} missed its deadline by {lag - deadline:.2f}sec, skipping {missed} tick(s)")
+            self.base_timestamp += missed * interval
+            due += missed * interval
+            lag -= missed * interval
+            if self.config.stale_ticks == "merge":
+                window_start = max(window_start, self.base_timestamp - self.config.max_merged_ticks * interval)
+            else:
+                window_start = self.base_timestamp
+
+        if lag < 0:
+            time.sleep(-lag / self.config.live_speed)
+            lag = self.get_game_clock() - due
+        self.live_lag.observe(max(lag, 0))
+        METRICS.observe("agent_live_lag_seconds", max(lag, 0))
+        return window_start
+
+    def get_live_stats(self) -> str:
+        return (
+            f"{self.live_lag.summary('Live lag')}\n"
+            f"Skipped ticks={self.skipped_ticks}, deadline misses={self.deadline_misses}, failed ticks={self.failed_ticks}"
         )
-        return past_events, future_events
+
+    def skip_empty_ticks(self) -> None:
+        """
+        Moves base_timestamp to the next tick whose past window holds a snapshot. With the window cache
+        that's a jump to the next stored snapshot instead of a query pair per empty interval.
+        """
+        interval = self.config.query_interval_sec
+        if self.window_cache is None:
+            self.base_timestamp += interval
+            return
+        self.base_timestamp = next_nonempty_tick(
+            self.window_cache,
+            self.base_timestamp + interval,
+            interval,
+            self.config.past_window_size_sec,
+            self.config.game_end_timestamp,
+        )
+
+    def compose_prompt(self, past_snapshots: list[dict], future_snapshots: list[dict], window_start: float | None = None) -> str:
+        with METRICS.timer("agent_prompt_compose_seconds"):
+            if self.prompt_cache is None:
+                prompt = self._compose_prompt(past_snapshots, future_snapshots)
+            else:
+                key = (
+                    self.base_timestamp if window_start is None else window_start,
+                    self.base_timestamp,
+                    self.config.past_window_size_sec,
+                    self.config.future_window_size_sec,
+                    self.config.compact_prompts,
+                    self.config.compact_float_digits,
+                    frozenset(self.config.focused_user_ids or ()),  # empty reads every player
+                )
+                prompt = self.prompt_cache.get_or_compose(key, lambda: self._compose_prompt(past_snapshots, future_snapshots))
+        self.prompt_sizes.observe(len(prompt))
+        METRICS.observe("agent_prompt_chars", len(prompt), SIZE_BUCKET_BOUNDS)
+        return prompt
+
+    def _compose_prompt(self, past_snapshots: list[dict], future_snapshots: list[dict]) -> str:
+        prompt = compose_prompt_from_snapshots(past_snapshots, future_snapshots)
+        if not self.config.compact_prompts:
+            return prompt
+
+        compact_prompt = compose_compact_prompt_from_snapshots(past_snapshots, future_snapshots, self.config.compact_float_digits)
+        reduction = 100 * (1 - len(compact_prompt) / len(prompt))
+        print(f"Prompt size: {len(compact_prompt)} chars instead of {len(prompt)} chars ({reduction:.1f}% smaller)")
+        return compact_prompt
+
+    def get_first_audio_stats(self) -> str:
+        return self.first_audio_delays.summary("Time to first audio")
 
     def print_stats(self) -> None:
         print(self.aws.models_mapping[self.config.model_id].get_model_stats())
+        print(self.aws.get_bedrock_stats(self.config.model_id))
         print(self.aws.get_polly_stats())
+        print(self.aws.get_tts_cache_stats())
+        if self.audio_cache_hit_delays.count:
+            print(self.audio_cache_hit_delays.summary("TTS cache hit latencies"))
+        if self.config.hedge_model_id is not None:
+            print(self.aws.hedging_stats)
+        if self.config.rag == "split":
+            print(self.aws.retrieval_cache.get_stats())
+        if self.first_audio_delays.count:
+            print(self.get_first_audio_stats())
+        if self.config.live or self.failed_ticks:
+            print(self.get_live_stats())
 
-    def _trim_queue(self) -> None:
-        init_prompts_list = self.config.init_prompts.to_list()
-        if len(self.q) + 2 > self.config.context_window_size:
-            for _ in range(len(init_prompts_list)):
-                self.q.popleft()
-            self.q.popleft()
-            self.q.popleft()
-            for prompt in reversed(init_prompts_list):
-                self.q.appendleft(prompt)
+    def _trim_queue(self, prompt: str) -> None:
+        trim_queue(
+            self.q,
+            self.config.context_window_size,
+            self.config.get_init_prompts(),
+            max_tokens=self.config.max_context_tokens,
+            incoming_text=prompt,
+        )
+
+    def log_prompt_size(self, prompt: str) -> None:
+        context_tokens = sum(estimate_tokens(message) for message in self.q)
+        print(
+            f"Tick {self.base_timestamp}: prompt {len(prompt)} chars (~{estimate_tokens(prompt)} tokens), "
+            f"context ~{context_tokens} tokens in {len(self.q)} messages"
+        )
 
     def main(self) -> None:
         session = self.db.get_session()
         dump_str_to_file(f"{self.dialogue_filename}.txt", self.dialogue[-1])
 
+        if self.config.live and self.live_started_at is None:
+            self.live_started_at = time.time()
+        attempt = 0
+
         while self.base_timestamp < self.config.game_end_timestamp:
-            past_events, future_events = self.get_events_from_db(session)
-            if not past_events:
-                self.base_timestamp += self.config.query_interval_sec
+            window_start = self.wait_for_tick() if self.config.live else self.base_timestamp
+            if self.base_timestamp >= self.config.game_end_timestamp:
+                break
+            past_snapshots, future_snapshots = self.get_snapshots(session, window_start)
+            if not past_snapshots:
+                self.skip_empty_ticks()
                 continue
 
-            prompt = compose_prompt_from_events(past_events, future_events)
-            self._trim_queue()
+            tick_started_at = time.perf_counter()
+            prompt = self.compose_prompt(past_snapshots, future_snapshots, window_start)
+            if self.config.rag == "split":
+                self.retrieval_query = build_retrieval_query(past_snapshots, future_snapshots)
+            self._trim_queue(prompt)
 
             self.q.append(prompt)
+            self.log_prompt_size(prompt)
             self.dialogue.append({"role": "User", "message": self.q[-1], "timestamp": self.base_timestamp})
             try:
-                sentences = self.generate_response()
-                self.generate_audios(sentences)
+                if self.config.pipelined_tts:
+                    sentences = self.generate_response_with_audios()
+                else:
+                    sentences = self.generate_response()
+                    self.generate_audios(sentences)
                 self.print_stats()
             except Exception as err:
-                print(f"Timestamp {self.base_timestamp} will be retried. Error: {err}")
-                continue
+                # an unanswered prompt would leave two user messages in a row
+                self.q.pop()
+                self.dialogue.pop()
+                self.remove_tick_audios()
+                attempt += 1
+                if attempt <= self.config.max_tick_retries:
+                    backoff = self.config.retry_backoff_sec * 2 ** (attempt - 1)
+                    print(f"Timestamp {self.base_timestamp} will be retried in {backoff:.2f}sec. Error: {err}")
+                    time.sleep(backoff)
+                    continue
+                print(f"Timestamp {self.base_timestamp} failed {attempt} times and is skipped. Error: {err}")
+                self.failed_ticks += 1
             except KeyboardInterrupt:
                 break
+            else:
+                self.q.append("".join(sentences))
+                self.dialogue.append({"role": "Assistant", "message": self.q[-1], "timestamp": self.base_timestamp})
+                dump_str_to_file(f"{self.dialogue_filename}.txt", self.dialogue[-1])
+                METRICS.observe("agent_tick_seconds", time.perf_counter() - tick_started_at)
 
-            self.q.append("".join(sentences))
-            self.dialogue.append({"role": "Assistant", "message": self.q[-1], "timestamp": self.base_timestamp})
-            dump_str_to_file(f"{self.dialogue_filename}.txt", self.dialogue[-1])
-
+            attempt = 0
             self.base_timestamp += self.config.query_interval_sec
 
         dump_dialogue_json(f"{self.dialogue_filename}.json", self.dialogue)
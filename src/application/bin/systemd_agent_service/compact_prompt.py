@@ -0,0 +1,126 @@
+"""
+Token-lean prompt composition. Consecutive snapshots are nearly identical, so only the first one
+of a tick is sent in full and every next one only carries per-player changes, with abbreviated
+keys, short player ids and rounded floats.
+"""
+
+import json
+
+from application.dtos.game_state_event import UNKNOWN_NICKNAME
+
+SHORT_ID_LENGTH = 8
+AI_PLAYER_ID = "ai"
+
+
+def short_id(user_id: str | None) -> str:
+    return user_id[:SHORT_ID_LENGTH] if user_id else AI_PLAYER_ID
+
+
+def build_short_ids(snapshots: list[dict]) -> dict[str, str]:
+    """Maps user ids to their short form, ids whose short forms collide are kept in full."""
+    user_ids = {player["user_id"] for snapshot in snapshots for player in snapshot["players"]}
+    prefixes: dict[str, set[str]] = {}
+    for user_id in user_ids:
+        prefixes.setdefault(short_id(user_id), set()).add(user_id)
+    return {user_id: short if len(same_prefix) == 1 else user_id for short, same_prefix in prefixes.items() for user_id in same_prefix}
+
+
+def player_keys(players: list[dict], short_ids: dict[str, str]) -> list[str]:
+    """Short ids of a snapshot's players, AI players all have an empty user id and are numbered ai1, ai2, ... in order."""
+    keys = []
+    ai_players = 0
+    for player in players:
+        if player["user_id"]:
+            keys.append(short_ids[player["user_id"]])
+        else:
+            ai_players += 1
+            keys.append(f"{AI_PLAYER_ID}{ai_players}")
+    return keys
+
+
+def round_floats(value, digits: int):
+    if isinstance(value, float):
+        rounded = round(value, digits)
+        return int(rounded) if rounded.is_integer() else rounded
+    if isinstance(value, list):
+        return [round_floats(item, digits) for item in value]
+    return value
+
+
+def compact_shot(shot: dict, digits: int) -> list:
+    kill_instigator, victim = shot["kill_instigator"], shot["victim"]
+    location = kill_instigator["location"]
+    return [
+        kill_instigator["weapon"]["name"],
+        kill_instigator["weapon"]["type"],
+        short_id(victim.get("user_id")),
+        victim["character"],
+        round_floats([location["x"], location["y"], location["z"]], digits),
+    ]
+
+
+def compact_player(player: dict, digits: int) -> dict:
+    compact = {"c": player["character"], "hp": player["hit_points"], "sh": player["shield"], "st": player["current_state"]}
+    if player.get("user_nickname") not in (None, UNKNOWN_NICKNAME):
+        compact = {"n": player["user_nickname"], **compact}
+    shots = [compact_shot(shot, digits) for shot in player["shot_list"]]
+    if shots:
+        compact["s"] = shots
+    return compact
+
+
+def player_delta(previous: dict, current: dict) -> dict:
+    delta = {}
+    for key, delta_key in (("hp", "dhp"), ("sh", "dsh")):
+        if current[key] != previous[key]:
+            delta[delta_key] = current[key] - previous[key]
+    if current["st"] != previous["st"]:
+        delta["st"] = current["st"]
+    previous_shots = [json.dumps(shot) for shot in previous.get("s", [])]
+    new_shots = []
+    for shot in current.get("s", []):
+        serialized = json.dumps(shot)
+        if serialized in previous_shots:
+            previous_shots.remove(serialized)
+        else:
+            new_shots.append(shot)
+    if new_shots:
+        delta["s"] = new_shots
+    return delta
+
+
+def compact_snapshots(
+    snapshots: list[dict], previous_players: dict | None, short_ids: dict[str, str], digits: int
+) -> tuple[list[dict], dict | None]:
+    """
+    Returns the compacted snapshots and the players of the last one, so the next list can continue the deltas.
+    """
+    compacted = []
+    for snapshot in snapshots:
+        players = {
+            key: compact_player(player, digits) for key, player in zip(player_keys(snapshot["players"], short_ids), snapshot["players"])
+        }
+        entry: dict = {"t": round_floats(snapshot["created_at"], digits)}
+        if previous_players is None:
+            entry["p"] = players
+        else:
+            changes = {}
+            for player_id, player in players.items():
+                if player_id not in previous_players:
+                    changes[player_id] = player
+                elif delta := player_delta(previous_players[player_id], player):
+                    changes[player_id] = delta
+            if changes:
+                entry["p"] = changes
+            if gone := [player_id for player_id in previous_players if player_id not in players]:
+                entry["gone"] = gone
+        compacted.append(entry)
+        previous_players = players
+    return compacted, previous_players
+
+
+def compose_compact_prompt_from_snapshots(past_snapshots: list[dict], future_snapshots: list[dict], float_digits: int = 1) -> str:
+    short_ids = build_short_ids(past_snapshots + future_snapshots)
+    past, last_players = compact_snapshots(past_snapshots, None, short_ids, float_digits)
+    future, _ = compact_snapshots(future_snapshots, last_players, short_ids, float_digits)
+    return json.dumps({"already_happened": past, "will_happen_soon": future}, separators=(",", ":"))
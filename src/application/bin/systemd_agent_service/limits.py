@@ -0,0 +1,17 @@
+import threading
+from contextlib import AbstractContextManager, nullcontext
+
+from application.dtos.agent_runtime_config import (
+    DEFAULT_MAX_LLM_CALLS,
+    DEFAULT_MAX_TTS_CALLS,
+)
+
+
+class ConcurrencyLimits:
+    """
+    Process-wide caps on in-flight Bedrock streams and Polly calls, shared by all agent services. None means unbounded.
+    """
+
+    def __init__(self, llm_calls: int | None = DEFAULT_MAX_LLM_CALLS, tts_calls: int | None = DEFAULT_MAX_TTS_CALLS) -> None:
+        self.llm_calls: AbstractContextManager = threading.BoundedSemaphore(llm_calls) if llm_calls else nullcontext()
+        self.tts_calls: AbstractContextManager = threading.BoundedSemaphore(tts_calls) if tts_calls else nullcontext()
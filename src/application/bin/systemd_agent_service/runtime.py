@@ -0,0 +1,38 @@
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from application.aws import AwsAPI
+from application.bin.systemd_agent_service.agent_service import AgentService
+from application.bin.systemd_agent_service.limits import ConcurrencyLimits
+from application.dtos.agent_runtime_config import AgentRuntimeConfig
+from application.dtos.agent_service_config import AgentServiceConfig
+from application.metrics import METRICS, MetricsDumper
+
+
+class AgentRuntime:
+    """
+    Drives many AgentService configs concurrently in one process. Services spend nearly all of their
+    time waiting on network I/O, so they run on threads, sharing one AwsAPI (boto3 clients are
+    thread-safe), the DatabaseConnection pool and the global concurrency caps.
+    """
+
+    def __init__(self, configs: list[AgentServiceConfig], runtime_config: AgentRuntimeConfig | None = None) -> None:
+        self.configs = configs
+        self.runtime_config = runtime_config or AgentRuntimeConfig()
+        self.limits = ConcurrencyLimits(llm_calls=self.runtime_config.max_llm_calls, tts_calls=self.runtime_config.max_tts_calls)
+        self.aws = AwsAPI()
+
+    def run_service(self, config: AgentServiceConfig) -> None:
+        print(f"Starting agent service with config: {config.model_dump()}")
+        AgentService(config, aws=self.aws, limits=self.limits).main()
+
+    def run(self) -> None:
+        metrics_path, metrics_interval_sec = self.runtime_config.metrics_path, self.runtime_config.metrics_interval_sec
+        dumper = MetricsDumper(METRICS, metrics_path, metrics_interval_sec) if metrics_path else nullcontext()
+        with dumper, ThreadPoolExecutor(max_workers=self.runtime_config.max_services, thread_name_prefix="agent-service") as executor:
+            futures = {executor.submit(self.run_service, config): config for config in self.configs}
+        for future, config in futures.items():
+            if err := future.exception():
+                print(f"Agent service with config {config.model_dump()} failed: {err}")
+                traceback.print_exception(err)
@@ -0,0 +1,119 @@
+import csv
+import json
+import os
+import threading
+import time
+from itertools import product
+
+from application.bin.systemd_agent_service.agent_service import AgentService
+from application.bin.systemd_agent_service.runtime import AgentRuntime
+from application.bin.systemd_agent_service.window_cache import (
+    SharedPromptCache,
+    SweepWindowStore,
+)
+from application.db_models import DatabaseConnection
+from application.dtos.agent_runtime_config import AgentRuntimeConfig
+from application.dtos.agent_service_config import AgentServiceConfig
+from application.metrics import StreamingHistogram
+
+SWEEP_RESULTS_FIELDS = [
+    "model_id",
+    "temperature",
+    "query_interval_sec",
+    "traits",
+    "ticks",
+    "avg_generation_sec",
+    "avg_polly_sec",
+    "tts_cache_hits",
+    "avg_first_audio_sec",
+    "avg_prompt_chars",
+    "audio_path",
+]
+
+
+def avg(histogram: StreamingHistogram) -> float | None:
+    return round(histogram.mean, 3) if histogram.count else None
+
+
+def expand_sweep(base_config: AgentServiceConfig, **grid: list) -> list[AgentServiceConfig]:
+    """
+    Cartesian product of the given field values over a base config, e.g.
+    expand_sweep(config, model_id=[ModelID.NOVA_PRO, ModelID.CLAUDE_SONNET], temperature=[0.5, 1.0]).
+    """
+    fields = list(grid)
+    return [base_config.model_copy(update=dict(zip(fields, values))) for values in product(*grid.values())]
+
+
+class ParameterSweep(AgentRuntime):
+    """
+    Runs many configs over the same match. All snapshots of the match are fetched and decoded once
+    and every distinct prompt window is composed once, so the configs only differ in the LLM and
+    Polly calls. Writes a consolidated results/latency table when done.
+    """
+
+    def __init__(
+        self,
+        configs: list[AgentServiceConfig],
+        runtime_config: AgentRuntimeConfig | None = None,
+        output_dir: str = "output/sweeps",
+    ) -> None:
+        super().__init__(configs, runtime_config)
+        self.output_dir = f"{output_dir}/{int(time.time())}"
+        start = min(config.game_start_timestamp for config in configs)
+        end = max(config.game_end_timestamp + config.past_window_size_sec + config.future_window_size_sec for config in configs)
+        started_at = time.time()
+        self.window_store = SweepWindowStore(DatabaseConnection(), start, end)
+        print(f"Loaded {len(self.window_store.snapshots)} snapshots for the sweep in {time.time() - started_at:.2f} s")
+        self.prompt_cache = SharedPromptCache()
+        self.results: list[dict] = []
+        self.results_lock = threading.Lock()
+
+    def run_service(self, config: AgentServiceConfig) -> None:
+        print(f"Starting agent service with config: {config.model_dump()}")
+        service = AgentService(
+            config,
+            aws=self.aws,
+            limits=self.limits,
+            window_cache=self.window_store,
+            prompt_cache=self.prompt_cache,
+        )
+        service.main()
+        dump = config.model_dump()
+        with self.results_lock:
+            self.results.append(
+                {
+                    "model_id": dump["model_id"],
+                    "temperature": config.temperature,
+                    "query_interval_sec": config.query_interval_sec,
+                    "traits": ",".join(dump["traits"]),
+                    "ticks": service.generation_delays.count,
+                    "avg_generation_sec": avg(service.generation_delays),
+                    "avg_polly_sec": avg(service.audio_delays),
+                    "tts_cache_hits": service.audio_cache_hit_delays.count,
+                    "avg_first_audio_sec": avg(service.first_audio_delays),
+                    "avg_prompt_chars": avg(service.prompt_sizes),
+                    "audio_path": service.audio_path,
+                }
+            )
+
+    def write_results(self) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(f"{self.output_dir}/results.csv", "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=SWEEP_RESULTS_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.results)
+        with open(f"{self.output_dir}/results.json", "w") as f:
+            json.dump(self.results, f, indent=4)
+
+    def print_results(self) -> None:
+        print(" | ".join(SWEEP_RESULTS_FIELDS[:-1]))
+        for result in self.results:
+            print(" | ".join(str(result[field]) for field in SWEEP_RESULTS_FIELDS[:-1]))
+        print(f"Prompt cache: {self.prompt_cache.hits} hits, {self.prompt_cache.misses} misses")
+
+    def run(self) -> None:
+        super().run()
+        self.results.sort(key=lambda result: [str(result[field]) for field in SWEEP_RESULTS_FIELDS])
+        self.write_results()
+        self.print_results()
+        print(f"Sweep results written to {self.output_dir}")
@@ -1,6 +1,13 @@
 import json
+from bisect import bisect_left
+from itertools import groupby
 
-from application.db_models import GameState
+from sqlalchemy import and_, select
+from sqlalchemy.orm import Session
+
+from application.db_models import GameState, PlayerState
+from application.dtos.game_state_event import resolve_player_nicknames
+from application.payload_codecs import decode_event_data
 
 
 def dump_str_to_file(filename: str, message: str) -> None:
@@ -13,12 +20,92 @@ def dump_dialogue_json(filename: str, dialogue: dict) -> None:
         json.dump(dialogue, f)
 
 
-def compose_prompt_from_events(past_events: list[GameState], future_events: list[GameState]) -> str:
-    past_jsons = [json.loads(event.event_data) for event in past_events]
-    future_jsons = [json.loads(event.event_data) for event in future_events]
+def decode_snapshot(event: GameState) -> dict:
+    return resolve_player_nicknames(decode_event_data(event))
+
+
+def build_retrieval_query(past_snapshots: list[dict], future_snapshots: list[dict]) -> str:
+    """
+    Knowledge base query of a tick: the characters, states, weapons and victims of the newest past snapshot
+    and the future window, leaving out the numbers that change every tick and the older snapshots.
+    """
+    terms: dict[str, None] = {}
+    for snapshot in past_snapshots[-1:] + future_snapshots:
+        for player in snapshot["players"]:
+            terms[player["character"]] = None
+            terms.update(dict.fromkeys(player["current_state"]))
+            for shot in player["shot_list"]:
+                weapon = shot["kill_instigator"]["weapon"]
+                terms.update(dict.fromkeys((weapon["name"], weapon["type"], shot["victim"]["character"])))
+    return " ".join(terms)
+
+
+def compose_prompt_from_snapshots(past_snapshots: list[dict], future_snapshots: list[dict]) -> str:
     return json.dumps(
         {
-            "already_happened": past_jsons,
-            "will_happen_soon": future_jsons,
+            "already_happened": past_snapshots,
+            "will_happen_soon": future_snapshots,
         }
     )
+
+
+def get_game_states_window(
+    session: Session, window_start: float, future_start: float, window_end: float
+) -> tuple[list[GameState], list[GameState]]:
+    """
+    Fetches [window_start, window_end) with one indexed range scan and splits it at future_start.
+    """
+    events: list[GameState] = (
+        session.query(GameState)
+        .filter(and_(GameState.event_created_at >= window_start, GameState.event_created_at < window_end))
+        .order_by(GameState.event_created_at)
+        .all()
+    )
+    split = bisect_left(events, future_start, key=lambda event: event.event_created_at)
+    return events[:split], events[split:]
+
+
+def get_player_states_window(
+    session: Session, user_ids: list[str], window_start: float, future_start: float, window_end: float
+) -> tuple[list[dict], list[dict]]:
+    """
+    Snapshots of only the given players in [window_start, window_end), split at future_start. Built from the
+    player_states rows through the (user_id, event_created_at) index, the game_states payloads aren't decoded.
+    """
+    states = session.execute(
+        select(
+            PlayerState.event_id,
+            PlayerState.event_created_at,
+            PlayerState.user_id,
+            PlayerState.user_nickname,
+            PlayerState.character,
+            PlayerState.hit_points,
+            PlayerState.shield,
+            PlayerState.current_states,
+            PlayerState.shot_list,
+        )
+        .where(
+            PlayerState.user_id.in_(user_ids),
+            PlayerState.event_created_at >= window_start,
+            PlayerState.event_created_at < window_end,
+        )
+        .order_by(PlayerState.event_created_at, PlayerState.event_id)
+    ).all()
+    snapshots = []
+    for _, sample_states in groupby(states, key=lambda state: state.event_id):
+        sample_states = list(sample_states)
+        players = [
+            {
+                "user_id": state.user_id,
+                "user_nickname": state.user_nickname,
+                "character": state.character,
+                "hit_points": state.hit_points,
+                "shield": state.shield,
+                "current_state": json.loads(state.current_states or "[]"),
+                "shot_list": json.loads(state.shot_list or "[]"),
+            }
+            for state in sample_states
+        ]
+        snapshots.append(resolve_player_nicknames({"created_at": float(sample_states[0].event_created_at), "players": players}))
+    split = bisect_left(snapshots, future_start, key=lambda snapshot: snapshot["created_at"])
+    return snapshots[:split], snapshots[split:]
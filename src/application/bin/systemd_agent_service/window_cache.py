@@ -0,0 +1,150 @@
+import math
+import threading
+from bisect import bisect_left
+from collections import deque
+from typing import Callable
+
+from sqlalchemy import func, select
+
+from application.bin.systemd_agent_service.utils import decode_snapshot
+from application.db_models import DatabaseConnection, GameState
+
+
+class GameStateWindowCache:
+    """
+    Serves the agent service tick windows from memory. Windows only move forward, so decoded
+    snapshots are fetched ahead in time-ordered chunks of `chunk_sec` and kept in a ring buffer
+    until they fall behind the past window.
+
+    Rows are committed in time order, also while the preprocessor follows a live feed, so a chunk is
+    only marked loaded up to the newest committed row. Anything from there on is queried again.
+    """
+
+    def __init__(self, db: DatabaseConnection, chunk_sec: float) -> None:
+        self.db = db
+        self.chunk_sec = chunk_sec
+        self.snapshots: deque[tuple[float, dict]] = deque()
+        # every row before loaded_until is committed and either buffered or evicted
+        self.loaded_until: float | None = None
+        self.db_round_trips = 0
+
+    def _query(self, statement):
+        self.db_round_trips += 1
+        with self.db.engine.connect() as connection:
+            return connection.execute(statement).all()
+
+    def _load(self, until: float) -> None:
+        if self.loaded_until >= until:
+            return
+        # buffered rows from loaded_until on may be joined by rows committed since, they're read again
+        while self.snapshots and self.snapshots[-1][0] >= self.loaded_until:
+            self.snapshots.pop()
+        (newest_created_at,) = self._query(select(func.max(GameState.event_created_at)))[0]
+        chunk_end = max(until, self.loaded_until + self.chunk_sec)
+        events = self._query(
+            select(GameState.event_created_at, GameState.event_codec, GameState.event_data, GameState.event_payload)
+            .where(GameState.event_created_at >= self.loaded_until, GameState.event_created_at < chunk_end)
+            .order_by(GameState.event_created_at)
+        )
+        self.snapshots.extend((event.event_created_at, decode_snapshot(event)) for event in events)
+        if newest_created_at is not None:
+            self.loaded_until = max(self.loaded_until, min(chunk_end, newest_created_at))
+
+    def _evict(self, before: float) -> None:
+        if self.loaded_until is None or before > self.loaded_until:
+            # nothing buffered is needed anymore, continue loading from the new position
+            self.snapshots.clear()
+            self.loaded_until = before
+            return
+        while self.snapshots and self.snapshots[0][0] < before:
+            self.snapshots.popleft()
+
+    def get_window(self, window_start: float, future_start: float, window_end: float) -> tuple[list[dict], list[dict]]:
+        self._evict(window_start)
+        self._load(window_end)
+        past, future = [], []
+        for created_at, snapshot in self.snapshots:
+            if created_at >= window_end:
+                break
+            (past if created_at < future_start else future).append(snapshot)
+        return past, future
+
+    def next_timestamp(self, after: float) -> float | None:
+        """Timestamp of the first stored snapshot at or after `after`, None if there's none."""
+        self._evict(after)
+        if not self.snapshots:
+            (next_created_at,) = self._query(
+                select(func.min(GameState.event_created_at)).where(GameState.event_created_at >= self.loaded_until)
+            )[0]
+            if next_created_at is None:
+                return None
+            self._evict(next_created_at)
+            self._load(next_created_at + self.chunk_sec)
+        return self.snapshots[0][0]
+
+
+class SweepWindowStore:
+    """
+    All snapshots of a match held in memory for a parameter sweep. Read-only after loading,
+    so any number of agent services can serve their windows from it concurrently.
+    """
+
+    def __init__(self, db: DatabaseConnection, start: float, end: float) -> None:
+        with db.engine.connect() as connection:
+            events = connection.execute(
+                select(GameState.event_created_at, GameState.event_codec, GameState.event_data, GameState.event_payload)
+                .where(GameState.event_created_at >= start, GameState.event_created_at < end)
+                .order_by(GameState.event_created_at)
+            ).all()
+        self.timestamps = [event.event_created_at for event in events]
+        self.snapshots = [decode_snapshot(event) for event in events]
+
+    def get_window(self, window_start: float, future_start: float, window_end: float) -> tuple[list[dict], list[dict]]:
+        start, split, end = (bisect_left(self.timestamps, timestamp) for timestamp in (window_start, future_start, window_end))
+        return self.snapshots[start:split], self.snapshots[split:end]
+
+    def next_timestamp(self, after: float) -> float | None:
+        i = bisect_left(self.timestamps, after)
+        return self.timestamps[i] if i < len(self.timestamps) else None
+
+
+def next_nonempty_tick(
+    window_source: GameStateWindowCache | SweepWindowStore, tick: float, interval: float, past_window_sec: float, end: float
+) -> float:
+    """
+    The first tick from `tick` on, stepping by `interval`, whose past window [tick, tick + past_window_sec)
+    holds a snapshot, `end` when there's none before it. Rows are only evicted up to the tick being looked at.
+    """
+    while tick < end:
+        next_created_at = window_source.next_timestamp(tick)
+        if next_created_at is None:
+            break
+        # the earliest tick whose past window still reaches the snapshot, with past windows longer than
+        # the interval that's before the last tick at or before it
+        tick += max(0, math.floor((next_created_at - past_window_sec - tick) / interval) + 1) * interval
+        if tick <= next_created_at:
+            return tick
+        # the snapshot falls between two past windows
+    return max(tick, end)
+
+
+class SharedPromptCache:
+    """
+    Composed prompts shared between agent services, each distinct window is composed once.
+    """
+
+    def __init__(self) -> None:
+        self.prompts: dict[tuple, str] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compose(self, key: tuple, compose: Callable[[], str]) -> str:
+        with self.lock:
+            if key in self.prompts:
+                self.hits += 1
+                return self.prompts[key]
+            self.misses += 1
+        prompt = compose()
+        with self.lock:
+            return self.prompts.setdefault(key, prompt)
@@ -0,0 +1,52 @@
+import json
+import os
+from pathlib import Path
+
+
+class Checkpoint:
+    """
+    Persists how many top-level group events of a dump are committed to the DB, so an
+    interrupted ingest resumes after them. The offset is only trusted while the dump is
+    unchanged, otherwise the ingest starts over, which is safe since inserts are idempotent.
+
+    A growing file (followed NDJSON feed) is identified by its inode instead and the offset is in
+    bytes. It's discarded once the file is shorter than the offset, i.e. it was truncated.
+    """
+
+    # batch checkpoints keep the key they always had, so existing ones are still resumed
+    EVENTS_DONE_KEY = "events_done"
+    OFFSET_KEY = "offset"
+
+    def __init__(self, path: Path, json_path: Path, growing: bool = False) -> None:
+        self.path = path
+        self.json_path = json_path
+        self.growing = growing
+        self.key = self.OFFSET_KEY if growing else self.EVENTS_DONE_KEY
+
+    def _identity(self) -> dict:
+        stat = self.json_path.stat()
+        if self.growing:
+            return {"json_path": str(self.json_path.resolve()), "inode": stat.st_ino}
+        return {"json_path": str(self.json_path.resolve()), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def load(self) -> int:
+        if not self.path.exists():
+            return 0
+        with open(self.path, "r") as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError:
+                return 0
+        if data.get("identity") != self._identity():
+            return 0
+        # batch checkpoints saved while both modes wrote "offset" are resumed too
+        offset = data.get(self.key, data.get(self.OFFSET_KEY, 0))
+        if self.growing and offset > self.json_path.stat().st_size:
+            return 0
+        return offset
+
+    def save(self, offset: int) -> None:
+        tmp_path = self.path.with_name(f"{self.path.name}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"identity": self._identity(), self.key: offset}, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,66 @@
+"""
+Re-encodes the stored game_states payloads with another codec, e.g. to compress an existing agent_db.sqlite.
+Run from src/: python -m application.bin.systemd_preprocessing_service.convert_codec marshal-zlib
+"""
+
+import argparse
+
+from sqlalchemy import bindparam, func, select, text
+
+from application.db_models import DatabaseConnection
+from application.db_models import GameState as DBGameState
+from application.payload_codecs import (
+    CODEC_TAGS,
+    DEFAULT_CODEC,
+    decode_event_data,
+    encode_event_data,
+)
+
+
+def convert_codec(tag: str, batch_size: int = 5000, vacuum: bool = True) -> int:
+    db = DatabaseConnection()
+    table = DBGameState.__table__
+    update = (
+        table.update()
+        .where(table.c.event_id == bindparam("b_event_id"))
+        .values(event_codec=bindparam("event_codec"), event_data=bindparam("event_data"), event_payload=bindparam("event_payload"))
+    )
+
+    converted, last_event_id = 0, ""
+    with db.engine.connect() as connection:
+        while True:
+            events = connection.execute(
+                select(table.c.event_id, table.c.event_codec, table.c.event_data, table.c.event_payload)
+                .where(table.c.event_id > last_event_id, func.coalesce(table.c.event_codec, DEFAULT_CODEC) != tag)
+                .order_by(table.c.event_id)
+                .limit(batch_size)
+            ).all()
+            if not events:
+                break
+
+            rows = [{"b_event_id": event.event_id, **encode_event_data(decode_event_data(event), tag)} for event in events]
+            connection.execute(update, rows)
+            connection.commit()
+
+            converted += len(rows)
+            last_event_id = events[-1].event_id
+            print(f"Converted {converted} rows to {tag}")
+
+    if vacuum:
+        # gives the freed pages back to the filesystem, can't run inside a transaction
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text("VACUUM"))
+    return converted
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("codec", choices=CODEC_TAGS)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--no-vacuum", action="store_true")
+    args = parser.parse_args()
+    convert_codec(args.codec, batch_size=args.batch_size, vacuum=not args.no_vacuum)
+
+
+if __name__ == "__main__":
+    main()
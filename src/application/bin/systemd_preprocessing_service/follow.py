@@ -0,0 +1,198 @@
+"""
+Live ingestion, a local stand-in for the game server feed. Follows either a growing NDJSON file,
+one group event per line, or a spool directory where each group event dump is dropped as a `.json` file.
+
+Spool producers should write under another name, e.g. `*.json.tmp`, and rename once done. A `.json` file is
+picked up only after its size and mtime stayed the same for one poll interval, so one that's written in
+place is not read half-way either. Malformed input is logged and set aside instead of stopping the follower:
+bad NDJSON lines are appended to `<feed>.rejected` and bad spool files are moved to `rejected/`.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import BinaryIO
+
+from application.bin.systemd_preprocessing_service.checkpoint import Checkpoint
+from application.bin.systemd_preprocessing_service.preprocess_v2 import (
+    group_event_to_rows,
+    load_group_events,
+)
+from application.bin.systemd_preprocessing_service.writer import (
+    BulkGameStateWriter,
+    Rows,
+)
+from application.db_models import DatabaseConnection
+from application.db_models import GameState as DBGameState
+from application.dtos.preprocess_config import PreprocessConfig
+
+SPOOL_DONE_FOLDER = "done"
+SPOOL_REJECTED_FOLDER = "rejected"
+REJECTED_LINES_SUFFIX = ".rejected"
+# what decoding or validating a malformed group event raises, pydantic's ValidationError is a ValueError
+MALFORMED_EVENT_ERRORS = (ValueError, KeyError, TypeError, AttributeError)
+
+
+class IngestLag:
+    """
+    Time from a sample's game timestamp until it's committed to the DB.
+    """
+
+    def __init__(self) -> None:
+        self.samples = 0
+        self.last_sec: float | None = None
+        self.max_sec = 0.0
+        self.total_sec = 0.0
+
+    def observe(self, rows: Rows, committed_at: float) -> None:
+        for row in rows.get(DBGameState, []):
+            lag = committed_at - row["event_created_at"]
+            self.samples += 1
+            self.last_sec = lag
+            self.max_sec = max(self.max_sec, lag)
+            self.total_sec += lag
+
+    def to_dict(self) -> dict:
+        return {
+            "samples": self.samples,
+            "last_sec": self.last_sec,
+            "avg_sec": self.total_sec / self.samples if self.samples else None,
+            "max_sec": self.max_sec,
+        }
+
+    def __str__(self) -> str:
+        stats = self.to_dict()
+        if not self.samples:
+            return "Ingest lag: no samples yet"
+        return f"Ingest lag: last={stats['last_sec']:.2f}sec, avg={stats['avg_sec']:.2f}sec, max={stats['max_sec']:.2f}sec"
+
+
+def read_complete_lines(file: BinaryIO, partial: bytes, chunk_size: int) -> tuple[list[bytes], bytes]:
+    """Reads at most `chunk_size` more bytes, a trailing line without newline is kept as partial."""
+    data = partial + file.read(chunk_size)
+    lines = data.split(b"\n")
+    return [line for line in lines[:-1] if line.strip()], lines[-1]
+
+
+class Follower:
+    def __init__(self, path: Path, config: PreprocessConfig, stop_event: threading.Event) -> None:
+        self.path = path
+        self.config = config
+        self.stop_event = stop_event
+        self.lag = IngestLag()
+        self.pending_rows: list[Rows] = []
+        # spool file -> (size, mtime) seen on the previous poll
+        self.spool_stats: dict[Path, tuple[int, int]] = {}
+
+    def write(self, writer: BulkGameStateWriter, event_dict: dict) -> None:
+        rows = group_event_to_rows(event_dict, self.config)
+        writer.write(rows)
+        self.pending_rows.append(rows)
+
+    def write_line(self, writer: BulkGameStateWriter, line: bytes) -> None:
+        try:
+            rows = group_event_to_rows(json.loads(line), self.config)
+        except MALFORMED_EVENT_ERRORS as e:
+            print(f"Skipping malformed line of {self.path}: {e!r}")
+            with open(f"{self.path}{REJECTED_LINES_SUFFIX}", "ab") as f:
+                f.write(line + b"\n")
+            return
+        writer.write(rows)
+        self.pending_rows.append(rows)
+
+    def commit(self, writer: BulkGameStateWriter) -> None:
+        writer.flush()
+        committed_at = time.time()
+        for rows in self.pending_rows:
+            self.lag.observe(rows, committed_at)
+        if self.pending_rows:
+            print(self.lag)
+            self.dump_metrics()
+        self.pending_rows = []
+
+    def dump_metrics(self) -> None:
+        if not self.config.follow_metrics_path:
+            return
+        tmp_path = f"{self.config.follow_metrics_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"ingest_lag": self.lag.to_dict(), "updated_at": time.time()}, f)
+        os.replace(tmp_path, self.config.follow_metrics_path)
+
+    async def follow_ndjson(self, writer: BulkGameStateWriter) -> None:
+        checkpoint = Checkpoint(Path(self.config.checkpoint_path), self.path, growing=True) if self.config.checkpoint_path else None
+        offset = checkpoint.load() if checkpoint else 0
+        partial = b""
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            while not self.stop_event.is_set():
+                if os.fstat(file.fileno()).st_size < offset:
+                    print(f"{self.path} was truncated, following it from the start")
+                    file.seek(0)
+                    offset, partial = 0, b""
+
+                lines, partial = read_complete_lines(file, partial, self.config.read_chunk_size)
+                for line in lines:
+                    self.write_line(writer, line)
+                if lines:
+                    self.commit(writer)
+                    offset = file.tell() - len(partial)
+                    if checkpoint:
+                        checkpoint.save(offset)
+                # a backlog is caught up on chunk by chunk without waiting in between
+                if file.tell() >= os.fstat(file.fileno()).st_size:
+                    await asyncio.sleep(self.config.follow_poll_interval_sec)
+
+    def get_settled_spool_files(self) -> list[Path]:
+        """Spooled files whose size and mtime didn't change since the previous poll."""
+        stats = {}
+        for json_path in self.path.glob("*.json"):
+            try:
+                stat = json_path.stat()
+            except FileNotFoundError:
+                continue
+            stats[json_path] = (stat.st_size, stat.st_mtime_ns)
+        settled = sorted(json_path for json_path, stat in stats.items() if self.spool_stats.get(json_path) == stat)
+        self.spool_stats = {json_path: stat for json_path, stat in stats.items() if json_path not in settled}
+        return settled
+
+    async def follow_spool(self, writer: BulkGameStateWriter) -> None:
+        done_path = self.path / SPOOL_DONE_FOLDER
+        rejected_path = self.path / SPOOL_REJECTED_FOLDER
+        done_path.mkdir(exist_ok=True)
+        rejected_path.mkdir(exist_ok=True)
+        while not self.stop_event.is_set():
+            for json_path in self.get_settled_spool_files():
+                target_path = done_path
+                try:
+                    for event_dict in load_group_events(json_path, self.config):
+                        self.write(writer, event_dict)
+                except MALFORMED_EVENT_ERRORS as e:
+                    # events read before the error are kept, inserts are idempotent if the file is fixed and re-spooled
+                    print(f"Rejecting malformed {json_path}: {e!r}")
+                    target_path = rejected_path
+                self.commit(writer)
+                shutil.move(json_path, target_path / json_path.name)
+            await asyncio.sleep(self.config.follow_poll_interval_sec)
+
+    async def run(self) -> None:
+        db = DatabaseConnection()
+        with BulkGameStateWriter(db, self.config.batch_size, self.config.batches_per_commit) as writer:
+            if self.path.is_dir():
+                await self.follow_spool(writer)
+            else:
+                await self.follow_ndjson(writer)
+
+
+async def run_follow(path: Path, config: PreprocessConfig | None = None, stop_event: threading.Event | None = None) -> None:
+    """
+    Ingests group events as they arrive until stop_event is set. New events are committed at the latest
+    one poll interval after they are written, the agent service can read the DB concurrently (WAL mode).
+    """
+    if not path.exists():
+        print(f"{path} not found!")
+        return
+    await Follower(path, config or PreprocessConfig(), stop_event or threading.Event()).run()
@@ -1,45 +1,209 @@
+import hashlib
 import json
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
+from typing import Generator, Iterable, TextIO
 
+from application.bin.account_service.account_container import AccountContainer
+from application.bin.systemd_preprocessing_service.checkpoint import Checkpoint
+from application.bin.systemd_preprocessing_service.writer import (
+    BulkGameStateWriter,
+    OrmGameStateWriter,
+    Rows,
+)
 from application.db_models import DatabaseConnection
 from application.db_models import GameState as DBGameState
-from application.dtos.game_state_event import GameStateGroupGameEvent
+from application.db_models import PlayerState as DBPlayerState
+from application.dtos.game_state_event import (
+    NICKNAMES_CONTEXT_KEY,
+    GameState,
+    GameStateGroupGameEvent,
+)
+from application.dtos.preprocess_config import PreprocessConfig
+from application.payload_codecs import encode_event_data
 
+JSON_WHITESPACE = " \t\r\n"
 
-async def run_preprocess(json_path: Path) -> None:
-    # Step 1: Load playground.json
-    print("i am here")
-    if not json_path.exists():
-        print(f"{json_path} file not found!")
-        return
 
+def iter_json_array(file: TextIO, chunk_size: int) -> Generator[dict, None, None]:
+    """
+    Incrementally parses a top-level JSON array, yielding its items one at a time.
+    Only the item being decoded is held in memory. A top-level object is yielded as a single item.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos = "", 0
+    started = False
+
+    while True:
+        while pos < len(buffer) and (buffer[pos] in JSON_WHITESPACE or (started and buffer[pos] == ",")):
+            pos += 1
+        if pos == len(buffer):
+            buffer, pos = file.read(chunk_size), 0
+            if not buffer:
+                return
+            continue
+
+        if not started:
+            started = True
+            if buffer[pos] == "[":
+                pos += 1
+                continue
+            yield json.loads(buffer[pos:] + file.read())
+            return
+
+        if buffer[pos] == "]":
+            return
+
+        try:
+            item, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # the item is cut by the chunk boundary, grow the buffer geometrically to keep re-decoding linear
+            chunk = file.read(max(chunk_size, len(buffer) - pos))
+            if not chunk:
+                raise
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+
+        yield item
+
+
+def load_group_events(json_path: Path, config: PreprocessConfig) -> Generator[dict, None, None]:
     with open(json_path, "r") as file:
-        raw_data: dict = json.load(file)
+        if config.streaming:
+            yield from iter_json_array(file, config.read_chunk_size)
+            return
+        raw_data: list[dict] | dict = json.load(file)
 
-    db = DatabaseConnection()
-    # Step 2: Convert raw data to GameStateEvent
-    for event_dict in raw_data:
-        game_state_event: GameStateGroupGameEvent = GameStateGroupGameEvent(**event_dict)
+    yield from [raw_data] if isinstance(raw_data, dict) else raw_data
 
-        session = db.get_session()
-        for event in game_state_event.event_data.game_states:
-            focused_players = []
-            for player in event.players:
-                if player.user_id == "83248802-90e1-705c-8702-e6c497b686d4":
-                    focused_players.append(player)
 
-            if not focused_players:
-                continue
+def sample_event_id(sample: dict) -> str:
+    """
+    Content hash of a raw sample, taken before player filtering and nickname resolution, so re-ingesting
+    the same dump with another focus or nicknames file replaces the stored samples instead of adding more.
+    """
+    canonical = json.dumps({"timestamp": sample.get("timestamp"), "players": sample["players"]}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def filter_focused_players(event_dict: dict, focused_user_ids: frozenset[str] | None) -> tuple[dict, list[str]]:
+    """
+    Drops unfocused players from the raw samples, and samples left without players, before any validation happens.
+    Returns the filtered event with the event ids of the samples that are left.
+    """
+    samples, event_ids = [], []
+    for sample in event_dict["event_data"]["samples"]:
+        players = sample["players"]
+        if focused_user_ids is not None:
+            players = [player for player in players if player.get("user_id") in focused_user_ids]
+        if players:
+            samples.append({**sample, "players": players})
+            event_ids.append(sample_event_id(sample))
+    return {**event_dict, "event_data": {**event_dict["event_data"], "samples": samples}}, event_ids
+
+
+def player_state_rows(event_id: str, game_state: GameState) -> list[dict]:
+    return [
+        {
+            "event_id": event_id,
+            "event_created_at": game_state.created_at,
+            "user_id": player.user_id,
+            "user_nickname": player.user_nickname,
+            "character": player.character,
+            "hit_points": player.hit_points,
+            "shield": player.shield,
+            "current_states": json.dumps(player.current_state),
+            "shots_count": len(player.shot_list),
+            "shot_list": json.dumps([shot.model_dump() for shot in player.shot_list]),
+        }
+        for player in game_state.players
+    ]
 
-            event.players = focused_players
 
-            event_data_dict = event.model_dump()
+def group_event_to_rows(event_dict: dict, config: PreprocessConfig) -> Rows:
+    event_dict, event_ids = filter_focused_players(event_dict, config.get_focused_user_ids())
+    game_state_event = GameStateGroupGameEvent.model_validate(event_dict, context={NICKNAMES_CONTEXT_KEY: config.resolve_nicknames})
 
-            db_model = DBGameState(event_created_at=event.created_at, event_data=json.dumps(event_data_dict))
+    rows: Rows = {DBGameState: []}
+    if config.write_player_states:
+        rows[DBPlayerState] = []
+    for event_id, event in zip(event_ids, game_state_event.event_data.game_states):
+        event_data = encode_event_data(event, config.codec)
 
-            session.add(db_model)
+        rows[DBGameState].append({"event_id": event_id, "event_created_at": event.created_at, **event_data})
+        if config.write_player_states:
+            rows[DBPlayerState].extend(player_state_rows(event_id, event))
+    return rows
+
+
+def group_events_to_rows(event_dicts: list[dict], config: PreprocessConfig) -> Rows:
+    rows: Rows = {}
+    for event_dict in event_dicts:
+        for model, model_rows in group_event_to_rows(event_dict, config).items():
+            rows.setdefault(model, []).extend(model_rows)
+    return rows
+
+
+def init_worker(user_nicknames_path: str | None) -> None:
+    if user_nicknames_path:
+        AccountContainer(file_path=user_nicknames_path)
+
+
+def iter_rows_parallel(raw_events: Iterable[dict], config: PreprocessConfig) -> Generator[tuple[Rows, int], None, None]:
+    """
+    Validates, filters and serializes chunks of group events in a process pool, yielding rows
+    with the number of group events they came from in input order.
+    At most 2 chunks per worker are in flight, so a streamed dump is never read ahead in full.
+    """
+    raw_events = iter(raw_events)
+    max_pending = config.workers * 2
+    with ProcessPoolExecutor(max_workers=config.workers, initializer=init_worker, initargs=(AccountContainer().file_path,)) as executor:
+        pending: deque[tuple[Future, int]] = deque()
+        while chunk := list(islice(raw_events, config.worker_chunk_size)):
+            pending.append((executor.submit(group_events_to_rows, chunk, config), len(chunk)))
+            if len(pending) >= max_pending:
+                future, events = pending.popleft()
+                yield future.result(), events
+        while pending:
+            future, events = pending.popleft()
+            yield future.result(), events
+
+
+async def run_preprocess(json_path: Path, config: PreprocessConfig | None = None) -> None:
+    config = config or PreprocessConfig()
+    # Step 1: Load playground.json
+    print("i am here")
+    if not json_path.exists():
+        print(f"{json_path} file not found!")
+        return
+
+    checkpoint = Checkpoint(Path(config.checkpoint_path), json_path) if config.checkpoint_path else None
+    events_done = checkpoint.load() if checkpoint else 0
+    if events_done:
+        print(f"Resuming {json_path} after {events_done} group events")
+
+    def on_commit(events_committed: int) -> None:
+        if checkpoint:
+            checkpoint.save(events_done + events_committed)
+
+    db = DatabaseConnection()
+    if config.bulk_insert:
+        writer = BulkGameStateWriter(db, config.batch_size, config.batches_per_commit, on_commit=on_commit)
+    else:
+        writer = OrmGameStateWriter(db, on_commit=on_commit)
+
+    raw_events = islice(load_group_events(json_path, config), events_done, None)
+    # Step 2: Convert raw data to GameStateEvent
+    if config.workers > 1:
+        rows_batches = iter_rows_parallel(raw_events, config)
+    else:
+        rows_batches = ((group_event_to_rows(event_dict, config), 1) for event_dict in raw_events)
 
-        session.commit()
+    with writer:
+        for rows, events in rows_batches:
+            writer.write(rows, events)
 
 
 # Entry point for the script
@@ -0,0 +1,132 @@
+from typing import Callable
+
+from sqlalchemy import Connection
+from sqlalchemy.orm import Session
+
+from application.db_models import Base, DatabaseConnection
+from application.db_models import GameState as DBGameState
+from application.db_models import PlayerState as DBPlayerState
+
+# rows to write, grouped by model in the order the tables have to be filled in
+Rows = dict[type[Base], list[dict]]
+# called with the number of group events durably committed so far
+OnCommit = Callable[[int], None]
+
+
+def delete_stored_samples(connection: Connection | Session, rows: Rows) -> None:
+    """
+    A sample that is written again replaces the stored one, e.g. when a dump is re-ingested with another focus,
+    so its rows are deleted first from both tables. The player rows may have been for other players.
+    """
+    event_ids = list({row["event_id"] for row in rows.get(DBGameState, [])})
+    connection.execute(DBPlayerState.__table__.delete().where(DBPlayerState.event_id.in_(event_ids)))
+    connection.execute(DBGameState.__table__.delete().where(DBGameState.event_id.in_(event_ids)))
+
+
+class OrmGameStateWriter:
+    """
+    Adds one ORM object per row and commits once per written group.
+    Samples that are already stored are replaced.
+    """
+
+    def __init__(self, db: DatabaseConnection, on_commit: OnCommit | None = None) -> None:
+        self.db = db
+        self.on_commit = on_commit
+        self.events_written = 0
+
+    def __enter__(self) -> "OrmGameStateWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        pass
+
+    def write(self, rows: Rows, events: int = 1) -> None:
+        session = self.db.get_session()
+        delete_stored_samples(session, rows)
+        for model, model_rows in rows.items():
+            # a sample can repeat within one write too, so only the first row per (sample, player) of any table is added
+            added = set()
+            for row in model_rows:
+                key = (row["event_id"], row.get("user_id"))
+                if key in added:
+                    continue
+                session.add(model(**row))
+                added.add(key)
+            session.flush()
+        session.commit()
+        session.close()
+        self.events_written += events
+        if self.on_commit:
+            self.on_commit(self.events_written)
+
+
+class BulkGameStateWriter:
+    """
+    Buffers rows and flushes them as executemany INSERT OR IGNORE once `batch_size` rows
+    are pending, committing once every `batches_per_commit` batches. Samples that are already
+    stored are replaced.
+    """
+
+    def __init__(self, db: DatabaseConnection, batch_size: int, batches_per_commit: int, on_commit: OnCommit | None = None) -> None:
+        self.db = db
+        self.batch_size = batch_size
+        self.batches_per_commit = batches_per_commit
+        self.on_commit = on_commit
+        self.pending: Rows = {}
+        self.pending_count = 0
+        self.batches_in_transaction = 0
+        self.rows_written = 0
+        self.events_written = 0
+
+    def __enter__(self) -> "BulkGameStateWriter":
+        self.connection = self.db.engine.connect()
+        self.transaction = self.connection.begin()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        try:
+            if exc_type is None:
+                if self.pending_count:
+                    self._insert()
+                self._commit()
+            else:
+                self.transaction.rollback()
+        finally:
+            self.connection.close()
+
+    def write(self, rows: Rows, events: int = 1) -> None:
+        for model, model_rows in rows.items():
+            self.pending.setdefault(model, []).extend(model_rows)
+            self.pending_count += len(model_rows)
+        self.events_written += events
+        if self.pending_count >= self.batch_size:
+            self._insert()
+
+    def flush(self) -> None:
+        """Inserts and commits everything pending, e.g. when a followed feed goes idle."""
+        if self.pending_count:
+            self._insert()
+        if self.batches_in_transaction:
+            self._commit()
+            self.transaction = self.connection.begin()
+            self.batches_in_transaction = 0
+
+    def _insert(self) -> None:
+        # all rows of a sample come with the same write, so they are in the same batch, repeats within it are ignored
+        delete_stored_samples(self.connection, self.pending)
+        for model, model_rows in self.pending.items():
+            if model_rows:
+                self.connection.execute(model.__table__.insert().prefix_with("OR IGNORE"), model_rows)
+        self.rows_written += self.pending_count
+        self.pending, self.pending_count = {}, 0
+        self.batches_in_transaction += 1
+        if self.batches_in_transaction >= self.batches_per_commit:
+            self._commit()
+            self.transaction = self.connection.begin()
+            self.batches_in_transaction = 0
+
+    def _commit(self) -> None:
+        # everything written so far has been inserted, so all of it is durable after the commit
+        self.transaction.commit()
+        if self.on_commit:
+            self.on_commit(self.events_written)
@@ -1,11 +1,31 @@
 import threading
 import uuid
 
-from sqlalchemy import Column, Integer, String, Text, create_engine
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+    create_engine,
+    event,
+    inspect,
+    text,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 SQLLITE_PATH = "sqlite:///agent_db.sqlite"
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -64000,  # negative value is in KiB, i.e. 64MB
+    "temp_store": "MEMORY",
+    # the agent service reads while the preprocessor follows a live feed, wait for the lock instead of failing
+    "busy_timeout": 5000,
+}
 
 
 Base = declarative_base()
@@ -15,8 +35,36 @@ class GameState(Base):
     __tablename__ = "game_states"
 
     event_id = Column(String(length=64), primary_key=True, default=lambda: str(uuid.uuid4()))
-    event_created_at = Column(Integer, nullable=False)
+    event_created_at = Column(Integer, nullable=False, index=True)
     event_data = Column(Text, nullable=True)
+    # see application.payload_codecs, NULL means plain JSON in event_data
+    event_codec = Column(String(length=16), nullable=True)
+    event_payload = Column(LargeBinary, nullable=True)
+
+
+class PlayerState(Base):
+    """
+    One player of one game_states sample, so the agent service can filter by player,
+    HP or shield in SQL instead of deserializing whole snapshots.
+    """
+
+    __tablename__ = "player_states"
+    __table_args__ = (
+        Index("ix_player_states_user_id_event_created_at", "user_id", "event_created_at"),
+        Index("ux_player_states_event_id_user_id", "event_id", "user_id", unique=True),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    event_id = Column(String(length=64), ForeignKey("game_states.event_id"), nullable=False)
+    event_created_at = Column(Integer, nullable=False)
+    user_id = Column(String(length=64), nullable=False)
+    user_nickname = Column(String(length=256), nullable=True)
+    character = Column(String(length=128), nullable=True)
+    hit_points = Column(Integer, nullable=False)
+    shield = Column(Integer, nullable=False)
+    current_states = Column(Text, nullable=True)  # JSON list
+    shots_count = Column(Integer, nullable=False, default=0)
+    shot_list = Column(Text, nullable=True)  # JSON list
 
 
 class DatabaseConnection:
@@ -33,8 +81,37 @@ class DatabaseConnection:
 
     def _initialize(self):
         self.engine = create_engine(SQLLITE_PATH)
+        event.listen(self.engine, "connect", self._set_sqlite_pragmas)
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
         Base.metadata.create_all(bind=self.engine)
+        self._migrate()
+
+    def _migrate(self) -> None:
+        # create_all() skips existing tables together with their indexes, so databases created before a column or
+        # an index was declared need it added. Only nullable columns can be added this way.
+        inspector = inspect(self.engine)
+        with self.engine.begin() as connection:
+            for table in Base.metadata.sorted_tables:
+                existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+                for column in table.columns:
+                    if column.name not in existing_columns:
+                        if not column.nullable:
+                            raise RuntimeError(
+                                f"{table.name}.{column.name} is NOT NULL and can't be added to the existing {SQLLITE_PATH}, "
+                                "migrate it by hand or re-create the database"
+                            )
+                        column_type = column.type.compile(dialect=self.engine.dialect)
+                        connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=self.engine, checkfirst=True)
+
+    @staticmethod
+    def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+        cursor = dbapi_connection.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
 
     def get_session(self):
         return self.SessionLocal()
@@ -0,0 +1,14 @@
+from pydantic import BaseModel, Field
+
+# process-wide caps on in-flight Bedrock streams and Polly calls, shared by all agent services,
+# keep them under the account's Bedrock concurrency and Polly TPS quotas
+DEFAULT_MAX_LLM_CALLS = 8
+DEFAULT_MAX_TTS_CALLS = 8
+
+
+class AgentRuntimeConfig(BaseModel):
+    max_services: int = Field(default=1, gt=0)  # 1 runs the agent service configs one after another
+    max_llm_calls: int = Field(default=DEFAULT_MAX_LLM_CALLS, gt=0)
+    max_tts_calls: int = Field(default=DEFAULT_MAX_TTS_CALLS, gt=0)
+    metrics_path: str | None = Field(default="output/metrics.json")  # JSON, or Prometheus text for a .prom path
+    metrics_interval_sec: float = Field(default=30, gt=0)
@@ -1,8 +1,19 @@
-from pydantic import BaseModel, Field
+from functools import lru_cache
+from typing import Literal
+
+from pydantic import BaseModel, Field, model_validator
 
 from application.dtos.game_state_event import GameStateGroupGameEvent
 from application.models import ModelID
 
+COMPACT_FORMAT_DESCRIPTION = (
+    "To save space the game state events come in a compact form: the first event of a list is complete, "
+    "each next one only has what changed since the previous one. "
+    "Keys: t=timestamp, p=players (by short player id, AI players are ai1, ai2, ...), n=nickname, c=character, "
+    "hp=hit points, sh=shield, st=current states, s=new shots as [weapon name, weapon type, victim id, victim character, [x, y, z]], "
+    "dhp/dsh=hit points/shield change, gone=players no longer present. "
+)
+
 
 class Trait(BaseModel):
     name: str = Field(..., alias="name")
@@ -15,26 +26,36 @@ class Trait(BaseModel):
         return self.__str__()
 
 
+@lru_cache(maxsize=64)
+def build_init_prompts(trait_descriptions: tuple[str, ...], compact_events: bool) -> tuple[str, ...]:
+    """
+    Memoized, the event sample is validated and serialized once per traits instead of on every trim.
+    """
+    event_sample = GameStateGroupGameEvent.sample()
+    compact_format_description = COMPACT_FORMAT_DESCRIPTION if compact_events else ""
+    return (
+        (
+            "Imagine you're commenting the battle royale game match. You'll be getting lists of game state events like this one: "
+            f"{event_sample.model_dump()} "
+            f"{compact_format_description}"
+            "Try to see the changes in the game state and comment on them. "
+            "Requirement 1: you need to use 3 senteces max. "
+            "Requirement 2: You're not supposed to always use each field for the comment, but you can use them if you think they're relevant. "
+            "Requirement 3: You will also get some events which haven't happened in the game yet, you can take them into consideration but "
+            "YOU CAN'T MENTION THAT YOU HAVE INFO FROM THE FUTURE UNDER NO CIRCUMSTANCES, ONLY USE IT TO ADJUST YOUR SENTIMENT IN COMMENTING ON CURRENT EVENTS. "
+            "Requirement 4: You need to adjust the commentary sentiment. "
+            f"Be {', '.join(trait_descriptions)} in your comments. "
+            "Understood?"
+        ),
+        "Understood. I'm ready to commentate on the battle royale game events with given character settings.",
+    )
+
+
 class InitPrompts(BaseModel):
     traits: list[Trait] = Field(..., alias="traits")
 
-    def to_list(self):
-        event_sample = GameStateGroupGameEvent.sample()
-        return [
-            (
-                "Imagine you're commenting the battle royale game match. You'll be getting lists of game state events like this one: "
-                f"{event_sample.model_dump()} "
-                "Try to see the changes in the game state and comment on them. "
-                "Requirement 1: you need to use 3 senteces max. "
-                "Requirement 2: You're not supposed to always use each field for the comment, but you can use them if you think they're relevant. "
-                "Requirement 3: You will also get some events which haven't happened in the game yet, you can take them into consideration but "
-                "YOU CAN'T MENTION THAT YOU HAVE INFO FROM THE FUTURE UNDER NO CIRCUMSTANCES, ONLY USE IT TO ADJUST YOUR SENTIMENT IN COMMENTING ON CURRENT EVENTS. "
-                "Requirement 4: You need to adjust the commentary sentiment. "
-                f"Be {', '.join(str(trait) for trait in self.traits)} in your comments. "
-                "Understood?"
-            ),
-            "Understood. I'm ready to commentate on the battle royale game events with given character settings.",
-        ]
+    def to_list(self, compact_events: bool = False) -> list[str]:
+        return list(build_init_prompts(tuple(str(trait) for trait in self.traits), compact_events))
 
 
 class AgentServiceConfig(BaseModel):
@@ -46,11 +67,48 @@ class AgentServiceConfig(BaseModel):
     game_end_timestamp: int = Field(...)
     model_id: ModelID = Field(default=ModelID.NOVA_PRO)
     context_window_size: int = Field(default=20)
+    max_context_tokens: int | None = Field(default=None, gt=0)  # estimated, None trims by message count only
     temperature: float = Field(default=0.9)
+    prefetch_chunk_sec: int = Field(default=60, ge=0)  # 0 queries the DB on every tick
+    # only these players' states are read, from player_states instead of the whole game_states snapshots
+    focused_user_ids: list[str] | None = Field(default=None)
+    compact_prompts: bool = Field(default=False)
+    compact_float_digits: int = Field(default=1, ge=0)
+    pipelined_tts: bool = Field(default=False)
+    tts_concurrency: int = Field(default=3, gt=0)  # parallel Polly calls per response
+    tts_max_retries: int = Field(default=4, ge=0)  # on Polly throttling
+    max_tick_retries: int = Field(default=3, ge=0)
+    retry_backoff_sec: float = Field(default=0.5, ge=0)  # doubles with every retry of a tick
+    # live mode paces ticks to the wall clock instead of running them back to back
+    live: bool = Field(default=False)
+    live_start_at: float | None = Field(default=None)  # wall-clock time of game_start_timestamp, None is when the service starts
+    live_speed: float = Field(default=1.0, gt=0)  # game seconds per wall-clock second, for replays
+    tick_deadline_sec: float | None = Field(default=None, ge=0)  # allowed lag of a tick, None is query_interval_sec
+    stale_ticks: Literal["skip", "merge"] = Field(default="merge")  # merge puts the skipped windows into the next tick
+    max_merged_ticks: int = Field(default=3, ge=1)
+    # hedging, the same request goes to hedge_model_id when the primary's first sentence is late
+    hedge_model_id: ModelID | None = Field(default=None)
+    hedge_percentile: float = Field(default=0.95, gt=0, lt=1)  # of the primary's observed time to first sentence
+    hedge_min_samples: int = Field(default=10, ge=1)  # below that hedge_delay_sec is used
+    hedge_delay_sec: float = Field(default=2.0, ge=0)
+    # knowledge base RAG, "retrieve_and_generate" is one call without the dialogue history,
+    # "split" retrieves (cached) passages and adds them to the regular request
+    rag: Literal["off", "retrieve_and_generate", "split"] = Field(default="off")
+    rag_results: int = Field(default=5, gt=0)
+
+    @model_validator(mode="after")
+    def check_hedge_model(self) -> "AgentServiceConfig":
+        if self.hedge_model_id == self.model_id:
+            raise ValueError("hedge_model_id must differ from model_id")
+        return self
+
+    def get_init_prompts(self) -> list[str]:
+        return self.init_prompts.to_list(compact_events=self.compact_prompts)
 
     def model_dump(self, *args, **kwargs):
         dump = super().model_dump(*args, **kwargs)
         del dump["init_prompts"]
         dump["traits"] = [str(trait) for trait in self.init_prompts.traits]
         dump["model_id"] = self.model_id.value
+        dump["hedge_model_id"] = self.hedge_model_id.value if self.hedge_model_id else None
         return dump
@@ -0,0 +1,34 @@
+import random
+
+from pydantic import BaseModel, Field
+
+
+class LatencyDistribution(BaseModel):
+    """
+    Normally distributed latency clipped to [min_sec, mean_sec + 3 * stddev_sec], plus `spike_sec`
+    with `spike_probability` for a heavy tail.
+    """
+
+    mean_sec: float = Field(..., ge=0)
+    stddev_sec: float = Field(default=0, ge=0)
+    min_sec: float = Field(default=0, ge=0)
+    spike_probability: float = Field(default=0, ge=0, le=1)
+    spike_sec: float = Field(default=0, ge=0)
+
+    def sample(self, rng: random.Random) -> float:
+        latency = min(max(rng.gauss(self.mean_sec, self.stddev_sec), self.min_sec), self.mean_sec + 3 * self.stddev_sec)
+        if self.spike_probability and rng.random() < self.spike_probability:
+            latency += self.spike_sec
+        return latency
+
+
+class FakeAwsConfig(BaseModel):
+    time_to_first_token: LatencyDistribution = Field(default=LatencyDistribution(mean_sec=0.6, stddev_sec=0.15))
+    inter_chunk_delay: LatencyDistribution = Field(default=LatencyDistribution(mean_sec=0.03, stddev_sec=0.01))
+    words_per_chunk: int = Field(default=3, gt=0)
+    sentences_per_response: int = Field(default=3, gt=0)
+    words_per_sentence: int = Field(default=12, gt=0)
+    tts_latency: LatencyDistribution = Field(default=LatencyDistribution(mean_sec=0.35, stddev_sec=0.1))
+    tts_latency_per_char_sec: float = Field(default=0.001, ge=0)
+    retrieval_latency: LatencyDistribution = Field(default=LatencyDistribution(mean_sec=0.3, stddev_sec=0.08))
+    seed: int | None = Field(default=None)
@@ -1,10 +1,14 @@
 from typing import List, Optional
 from uuid import uuid4
 
-from pydantic import BaseModel, Field, field_validator, model_validator
+from pydantic import BaseModel, Field, ValidationInfo, field_validator, model_validator
 
 from application.bin.account_service.account_container import AccountContainer
 
+UNKNOWN_NICKNAME = "Unknown"
+# validation context flag, nicknames are resolved unless it's set to False
+NICKNAMES_CONTEXT_KEY = "resolve_nicknames"
+
 
 class Location(BaseModel):
     x: float = Field(..., alias="x")
@@ -73,7 +77,7 @@ class Ammo(BaseModel):
 
 class Player(BaseModel):
     user_id: str = Field(..., alias="user_id")
-    user_nickname: str = Field(default="Unknown")
+    user_nickname: Optional[str] = Field(default=None)  # None until resolved, see NICKNAMES_CONTEXT_KEY
     character: str = Field(..., alias="character")
     # location: Location = Field(..., alias="location")
     # rotation: Rotation = Field(..., alias="rotation")
@@ -91,7 +95,9 @@ class Player(BaseModel):
 
     @model_validator(mode="after")
     @classmethod
-    def model_after_validator(cls, obj):
+    def model_after_validator(cls, obj, info: ValidationInfo):
+        if info.context and not info.context.get(NICKNAMES_CONTEXT_KEY, True):
+            return obj
         nickname = user_nickname_mapper(obj.user_id)
         obj.user_nickname = nickname
         return obj
@@ -150,11 +156,34 @@ class GameStateGroupGameEvent(BaseModel):
         )
 
 
-def user_nickname_mapper(user_id: str):
+# only ids that resolved are cached, unknown ones are looked up again in case the nicknames are reloaded
+nickname_cache: dict[str, str] = {}
+
+
+def user_nickname_mapper(user_id: str) -> str:
+    """
+    Memoized, the nicknames are loaded once at startup. Call nickname_cache.clear() if the AccountContainer is re-initialized.
+    """
     if user_id == "":
         return "AI Player"
-    else:
-        return AccountContainer().get_nick(user_id, default="Unknown")
+    nickname = nickname_cache.get(user_id)
+    if nickname is None:
+        nickname = AccountContainer().get_nick(user_id)
+        if nickname is None:
+            return UNKNOWN_NICKNAME
+        nickname_cache[user_id] = nickname
+    return nickname
+
+
+def resolve_player_nicknames(game_state: dict) -> dict:
+    """
+    Fills in nicknames of a dumped game state which was validated with nickname resolution deferred,
+    unknown ones are retried since the nicknames file may have been updated since.
+    """
+    for player in game_state.get("players", []):
+        if player.get("user_nickname") in (None, UNKNOWN_NICKNAME):
+            player["user_nickname"] = user_nickname_mapper(player["user_id"])
+    return game_state
 
 
 def main():
@@ -0,0 +1,38 @@
+from typing import Literal
+
+from pydantic import BaseModel, Field, field_validator
+
+from application.payload_codecs import CODEC_TAGS, DEFAULT_CODEC
+
+FOCUS_ALL_PLAYERS = "all"
+
+
+class PreprocessConfig(BaseModel):
+    streaming: bool = Field(default=False)
+    read_chunk_size: int = Field(default=1 << 16, gt=0)
+    bulk_insert: bool = Field(default=False)
+    batch_size: int = Field(default=5000, gt=0)
+    batches_per_commit: int = Field(default=20, gt=0)
+    workers: int = Field(default=1, gt=0)
+    worker_chunk_size: int = Field(default=16, gt=0)
+    checkpoint_path: str | None = Field(default=None)  # resume file, e.g. "data/preprocess_checkpoint.json"
+    follow_poll_interval_sec: float = Field(default=0.25, gt=0)
+    follow_metrics_path: str | None = Field(default=None)  # ingest lag JSON, rewritten on every commit
+    codec: str = Field(default=DEFAULT_CODEC)  # see application.payload_codecs, "marshal-zlib" is the smallest and fastest to read
+    write_player_states: bool = Field(default=True)
+    resolve_nicknames: bool = Field(default=True)  # False defers them to prompt composition
+    focused_user_ids: list[str] | Literal["all"] = Field(default_factory=lambda: ["83248802-90e1-705c-8702-e6c497b686d4"])
+
+    @field_validator("codec")
+    @classmethod
+    def check_codec(cls, codec: str) -> str:
+        # zstd codecs are only registered when zstandard is installed, so it's checked against the registry
+        if codec not in CODEC_TAGS:
+            raise ValueError(f"Unknown payload codec {codec!r}, available: {list(CODEC_TAGS)}")
+        return codec
+
+    def get_focused_user_ids(self) -> frozenset[str] | None:
+        """Returns None when every player is in focus."""
+        if self.focused_user_ids == FOCUS_ALL_PLAYERS:
+            return None
+        return frozenset(self.focused_user_ids)
@@ -0,0 +1,138 @@
+import io
+import json
+import random
+import threading
+import time
+from typing import Generator
+
+from application.aws import AwsAPI
+from application.dtos.fake_aws_config import FakeAwsConfig
+from application.models import Anthropic, ModelID, NovaPro
+
+FAKE_WORDS = ("what", "a", "shot", "the", "squad", "pushes", "into", "zone", "and", "he", "is", "down", "low", "on", "shield")
+
+
+class FakeLatencies:
+    """
+    Samples latencies from the config, thread-safe so fakes can serve concurrent agent services.
+    """
+
+    def __init__(self, config: FakeAwsConfig) -> None:
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.lock = threading.Lock()
+
+    def sample(self, distribution) -> float:
+        with self.lock:
+            return distribution.sample(self.rng)
+
+    def make_sentences(self) -> list[str]:
+        with self.lock:
+            return [
+                " ".join(self.rng.choice(FAKE_WORDS) for _ in range(self.config.words_per_sentence)).capitalize() + "."
+                for _ in range(self.config.sentences_per_response)
+            ]
+
+
+class FakeBedrockRuntime:
+    """
+    Stands in for the bedrock-runtime client, streams a made-up response in the chunk format of the model
+    family with the configured time to first token and inter-chunk delay.
+    """
+
+    def __init__(self, latencies: FakeLatencies, chunk_format: str) -> None:
+        self.latencies = latencies
+        self.chunk_format = chunk_format
+
+    def make_chunk(self, text: str) -> dict:
+        if self.chunk_format == "nova":
+            payload = {"contentBlockDelta": {"delta": {"text": text}}}
+        else:
+            payload = {"type": "content_block_delta", "delta": {"type": "text_delta", "text": text}}
+        return {"chunk": {"bytes": json.dumps(payload).encode("utf-8")}}
+
+    def invoke_model_with_response_stream(self, modelId: str, body: str) -> dict:
+        return {"body": FakeEventStream(self)}
+
+
+class FakeEventStream:
+    """
+    Like botocore's EventStream, iterates the chunks and can be closed from another thread,
+    which ends an iteration that is waiting for the next chunk.
+    """
+
+    def __init__(self, runtime: FakeBedrockRuntime) -> None:
+        self.runtime = runtime
+        self.closed = threading.Event()
+
+    def __iter__(self) -> Generator[dict, None, None]:
+        config = self.runtime.latencies.config
+        words = " ".join(self.runtime.latencies.make_sentences()).split(" ")
+        if self.closed.wait(self.runtime.latencies.sample(config.time_to_first_token)):
+            return
+        for i in range(0, len(words), config.words_per_chunk):
+            if i and self.closed.wait(self.runtime.latencies.sample(config.inter_chunk_delay)):
+                return
+            yield self.runtime.make_chunk(" ".join(words[i : i + config.words_per_chunk]) + " ")
+
+    def close(self) -> None:
+        self.closed.set()
+
+
+class FakePolly:
+    """
+    Stands in for the Polly client, returns a few bytes of fake audio after the configured latency.
+    """
+
+    def __init__(self, latencies: FakeLatencies) -> None:
+        self.latencies = latencies
+
+    def synthesize_speech(self, Text: str, **kwargs) -> dict:
+        config = self.latencies.config
+        time.sleep(self.latencies.sample(config.tts_latency) + config.tts_latency_per_char_sec * len(Text))
+        return {"AudioStream": io.BytesIO(Text.encode("utf-8"))}
+
+
+class FakeBedrockAgentRuntime:
+    """
+    Stands in for the bedrock-agent-runtime client's knowledge base retrieval.
+    """
+
+    def __init__(self, latencies: FakeLatencies) -> None:
+        self.latencies = latencies
+
+    def retrieve(self, knowledgeBaseId: str, retrievalQuery: dict, retrievalConfiguration: dict) -> dict:
+        time.sleep(self.latencies.sample(self.latencies.config.retrieval_latency))
+        number_of_results = retrievalConfiguration["vectorSearchConfiguration"]["numberOfResults"]
+        return {
+            "retrievalResults": [
+                {"content": {"text": sentence}, "score": 1 - i / number_of_results}
+                for i, sentence in enumerate(self.latencies.make_sentences()[:number_of_results])
+            ]
+        }
+
+
+def install_fakes(aws: AwsAPI, config: FakeAwsConfig, model_configs: dict[ModelID, FakeAwsConfig] | None = None) -> AwsAPI:
+    """
+    Swaps the Bedrock, knowledge base retrieval and Polly clients of `aws` for the fakes, everything above the clients runs as in production.
+    `model_configs` overrides the Bedrock latencies per model, e.g. to give the hedging a slow primary.
+    """
+    latencies = FakeLatencies(config)
+    model_configs = model_configs or {}
+    for model in aws.models_mapping.values():
+        assert isinstance(model, (NovaPro, Anthropic)), f"No fake chunk format for {model.model_id}"
+        chunk_format = "nova" if isinstance(model, NovaPro) else "anthropic"
+        model_latencies = FakeLatencies(model_configs[model.model_id]) if model.model_id in model_configs else latencies
+        model.bedrock_runtime = FakeBedrockRuntime(model_latencies, chunk_format)
+    aws.polly = FakePolly(latencies)
+    aws.bedrock_agent_runtime = FakeBedrockAgentRuntime(latencies)
+    return aws
+
+
+def make_fake_aws(
+    config: FakeAwsConfig | None = None,
+    model_configs: dict[ModelID, FakeAwsConfig] | None = None,
+    **kwargs,
+) -> AwsAPI:
+    kwargs.setdefault("tts_cache_dir", "")
+    return install_fakes(AwsAPI(**kwargs), config or FakeAwsConfig(), model_configs)
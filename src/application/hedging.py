@@ -0,0 +1,187 @@
+"""
+Hedged Bedrock requests. The request goes to the primary model, and if its first sentence is late,
+the same request also goes to the secondary model. Whichever model streams a sentence first is used,
+the other stream is closed. A primary that fails before its first sentence falls back to the secondary.
+"""
+
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import Generator
+
+from application.models import Model, ModelID
+
+
+class HedgingStats:
+    """
+    Per model: requests started as primary or as hedge, wins and losses, so the extra requests
+    hedging costs can be weighed against how often the hedge beat a slow primary.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.fallbacks = 0
+        self.started: dict[ModelID, int] = defaultdict(int)
+        self.wins: dict[ModelID, int] = defaultdict(int)
+        self.hedge_wins: dict[ModelID, int] = defaultdict(int)
+
+    def record(self, started: list[ModelID], winner: ModelID | None, fallback: bool) -> None:
+        with self.lock:
+            self.requests += 1
+            self.hedged += len(started) > 1
+            self.fallbacks += fallback
+            for model_id in started:
+                self.started[model_id] += 1
+            if winner is not None:
+                self.wins[winner] += 1
+                if len(started) > 1 and winner != started[0]:
+                    self.hedge_wins[winner] += 1
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "fallbacks": self.fallbacks,
+                "models": {
+                    model_id.value: {
+                        "started": self.started[model_id],
+                        "wins": self.wins[model_id],
+                        "win_rate": self.wins[model_id] / self.started[model_id],
+                        "wins_as_hedge": self.hedge_wins[model_id],
+                    }
+                    for model_id in self.started
+                },
+            }
+
+    def __str__(self) -> str:
+        stats = self.to_dict()
+        if not stats["requests"]:
+            return "Hedging: no requests yet"
+        models = ", ".join(
+            f"{model_id} won {model['wins']}/{model['started']} ({model['win_rate']:.0%}, {model['wins_as_hedge']} as hedge)"
+            for model_id, model in stats["models"].items()
+        )
+        return f"Hedging: hedged {stats['hedged']}/{stats['requests']} requests, {stats['fallbacks']} fallbacks; {models}"
+
+
+class HedgedStream:
+    """
+    One model's side of a hedged request. Its sentences are pumped into the shared queue from a thread,
+    and the coordinator cancels it by closing the response body, which aborts a read that is in progress.
+    """
+
+    def __init__(self, model: Model, prompts: list[str], temperature: float, events: queue.Queue) -> None:
+        self.model = model
+        self.prompts = prompts
+        self.temperature = temperature
+        self.events = events
+        self.cancelled = threading.Event()
+        self.stream_body = None
+        self.lock = threading.Lock()
+
+    def start(self) -> None:
+        threading.Thread(target=self.pump, name=f"hedge-{self.model.model_id.name.lower()}", daemon=True).start()
+
+    def pump(self) -> None:
+        model_id = self.model.model_id
+        try:
+            started_at = time.perf_counter()
+            stream_body = self.model.invoke_stream(self.model.get_messages(self.prompts), self.temperature)
+            with self.lock:
+                self.stream_body = stream_body
+            if self.cancelled.is_set():
+                self.close_stream()
+                return
+            sentences = self.model.generate_sentences_from_stream(stream_body, self.model.get_text_from_chunk, started_at)
+            try:
+                for sentence in sentences:
+                    if self.cancelled.is_set():
+                        return
+                    self.events.put((model_id, "sentence", sentence))
+            finally:
+                sentences.close()
+            self.events.put((model_id, "done", None))
+        except Exception as err:
+            # closing the body makes the blocked read fail, that's no error of a cancelled stream
+            if not self.cancelled.is_set():
+                self.events.put((model_id, "error", err))
+
+    def close_stream(self) -> None:
+        with self.lock:
+            stream_body = self.stream_body
+        if stream_body is not None and hasattr(stream_body, "close"):
+            stream_body.close()
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+        self.close_stream()
+
+
+def hedged_sentences(
+    primary: Model,
+    secondary: Model,
+    prompts: list[str],
+    temperature: float,
+    hedge_after_sec: float,
+    stats: HedgingStats,
+) -> Generator[str, None, None]:
+    events: queue.Queue = queue.Queue()
+    streams: dict[ModelID, HedgedStream] = {}
+
+    def start(model: Model) -> None:
+        streams[model.model_id] = HedgedStream(model, prompts, temperature, events)
+        streams[model.model_id].start()
+
+    try:
+        started_at = time.perf_counter()
+        start(primary)
+        winner = first_sentence = first_error = None
+        fallback = False
+        running = 1
+        while winner is None:
+            timeout = None if secondary.model_id in streams else max(hedge_after_sec - (time.perf_counter() - started_at), 0)
+            try:
+                model_id, kind, payload = events.get(timeout=timeout)
+            except queue.Empty:
+                start(secondary)
+                running += 1
+                continue
+            if kind == "error":
+                first_error = first_error or payload
+                running -= 1
+                if secondary.model_id not in streams:
+                    fallback = True
+                    start(secondary)
+                    running += 1
+                elif not running:
+                    stats.record(list(streams), None, fallback)
+                    raise first_error
+                continue
+            # a model that completes without any sentence wins too, the response is just empty
+            winner, first_sentence = model_id, payload
+
+        for model_id, stream in streams.items():
+            if model_id != winner:
+                stream.cancel()
+        stats.record(list(streams), winner, fallback)
+
+        if first_sentence is None:
+            return
+        yield first_sentence
+        while True:
+            model_id, kind, payload = events.get()
+            if model_id != winner:
+                continue
+            if kind == "error":
+                raise payload
+            if kind == "done":
+                return
+            yield payload
+    finally:
+        # also reached when the consumer stops iterating early, none of the streams is left open
+        for stream in streams.values():
+            stream.cancel()
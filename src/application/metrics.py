@@ -0,0 +1,177 @@
+"""
+In-process latency metrics. Histograms use fixed log-spaced buckets, so memory stays constant however
+long a service runs, and quantiles come out within one bucket width (~12%) of the exact value.
+Exported as JSON or Prometheus text, optionally dumped to a file periodically.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Iterator
+
+# bucket upper bounds from 0.1 ms to ~5 min growing by 25%, last bucket catches everything above
+BUCKET_GROWTH = 1.25
+BUCKET_BOUNDS = tuple(1e-4 * BUCKET_GROWTH**i for i in range(int(math.log(3e6, BUCKET_GROWTH)) + 2))
+# for sizes, e.g. prompt chars, from 1 to ~10M
+SIZE_BUCKET_BOUNDS = tuple(BUCKET_GROWTH**i for i in range(int(math.log(1e7, BUCKET_GROWTH)) + 2))
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class StreamingHistogram:
+    def __init__(self, bounds: tuple[float, ...] = BUCKET_BOUNDS) -> None:
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min: float | None = None
+        self.max: float | None = None
+        self.last: float | None = None
+        self.lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        bucket = bisect_left(self.bounds, value)
+        with self.lock:
+            self.buckets[bucket] += 1
+            self.count += 1
+            self.sum += value
+            self.min = value if self.min is None else min(self.min, value)
+            self.max = value if self.max is None else max(self.max, value)
+            self.last = value
+
+    @property
+    def mean(self) -> float | None:
+        return self.sum / self.count if self.count else None
+
+    def quantile(self, q: float) -> float | None:
+        """
+        Linear interpolation inside the bucket holding the q-th observation, clamped to the observed min/max.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, bucket in enumerate(self.buckets):
+            if bucket and seen + bucket >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0.0
+                upper = self.bounds[i] if i < len(self.bounds) else self.max
+                value = lower + (upper - lower) * (rank - seen) / bucket
+                return min(max(value, self.min), self.max)
+            seen += bucket
+        return self.max
+
+    def to_dict(self) -> dict:
+        stats = {"count": self.count, "sum": self.sum, "avg": self.mean, "min": self.min, "max": self.max, "last": self.last}
+        stats.update({f"p{int(q * 100)}": self.quantile(q) for q in QUANTILES})
+        return stats
+
+    def summary(self, name: str) -> str:
+        if not self.count:
+            return f"{name}: no samples yet"
+        stats = self.to_dict()
+        return (
+            f"{name}: last={stats['last']:.2f}sec, avg={stats['avg']:.2f}sec, p50={stats['p50']:.2f}sec, "
+            f"p95={stats['p95']:.2f}sec, p99={stats['p99']:.2f}sec, min={stats['min']:.2f}sec, max={stats['max']:.2f}sec"
+        )
+
+
+class MetricsRegistry:
+    """
+    Named histograms with optional labels, e.g. observe("bedrock_generation_seconds", 1.2, model="amazon.nova-pro-v1:0").
+    """
+
+    def __init__(self) -> None:
+        self.histograms: dict[tuple[str, tuple[tuple[str, str], ...]], StreamingHistogram] = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name: str, bounds: tuple[float, ...] = BUCKET_BOUNDS, **labels: str) -> StreamingHistogram:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = StreamingHistogram(bounds)
+            return self.histograms[key]
+
+    def observe(self, name: str, value: float, bounds: tuple[float, ...] = BUCKET_BOUNDS, **labels: str) -> None:
+        self.histogram(name, bounds, **labels).observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            histograms = list(self.histograms.items())
+        return {
+            name + ("{" + ",".join(f"{key}={value}" for key, value in labels) + "}" if labels else ""): histogram.to_dict()
+            for (name, labels), histogram in sorted(histograms)
+        }
+
+    def to_json(self) -> str:
+        return json.dumps({"metrics": self.to_dict(), "updated_at": time.time()})
+
+    def to_prometheus(self) -> str:
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+        lines = []
+        previous_name = None
+        for (name, labels), histogram in histograms:
+            if name != previous_name:
+                lines.append(f"# TYPE {name} histogram")
+                previous_name = name
+            label_pairs = [f'{key}="{value}"' for key, value in labels]
+            cumulative = 0
+            for bound, bucket in zip(histogram.bounds + (math.inf,), histogram.buckets):
+                cumulative += bucket
+                le = "+Inf" if math.isinf(bound) else f"{bound:.6g}"
+                bucket_labels = ",".join(label_pairs + [f'le="{le}"'])
+                lines.append(f"{name}_bucket{{{bucket_labels}}} {cumulative}")
+            label_str = "{" + ",".join(label_pairs) + "}" if label_pairs else ""
+            lines.append(f"{name}_sum{label_str} {histogram.sum}")
+            lines.append(f"{name}_count{label_str} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str) -> None:
+        """
+        Writes JSON or, for a `.prom` path, Prometheus text (e.g. for the node exporter textfile collector).
+        """
+        content = self.to_prometheus() if path.endswith(".prom") else self.to_json()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+
+class MetricsDumper:
+    """
+    Dumps the registry every `interval_sec` on a daemon thread, and once more on stop.
+    """
+
+    def __init__(self, registry: MetricsRegistry, path: str, interval_sec: float = 30) -> None:
+        self.registry = registry
+        self.path = path
+        self.interval_sec = interval_sec
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="metrics-dumper", daemon=True)
+
+    def run(self) -> None:
+        while not self.stop_event.wait(self.interval_sec):
+            self.registry.dump(self.path)
+
+    def __enter__(self) -> "MetricsDumper":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop_event.set()
+        self.thread.join()
+        self.registry.dump(self.path)
+
+
+METRICS = MetricsRegistry()
@@ -1,9 +1,11 @@
 import json
+import time
 from abc import ABC, abstractmethod
 from enum import Enum
 from typing import Callable, Generator
 
-import boto3
+from application.aws_clients import AwsClients
+from application.metrics import METRICS
 
 
 class ModelID(Enum):
@@ -17,54 +19,105 @@ class Model(ABC):
         self.model_id = model_id
         self.region = region
         self.arn = f"arn:aws:bedrock:{region}::foundation-model/{model_id.value}"
-        self.bedrock_runtime = boto3.client("bedrock-runtime", region_name=region)
-        self.delays: list[float] = []
-
-    def generate_sentences_from_stream(self, stream_body, text_getter: Callable[[dict], str]) -> Generator[str, None, None]:
+        self._bedrock_runtime = None
+
+    @property
+    def bedrock_runtime(self):
+        # created on first request, so the unused models of AwsAPI.models_mapping cost nothing
+        if self._bedrock_runtime is None:
+            self._bedrock_runtime = AwsClients().get("bedrock-runtime", self.region)
+        return self._bedrock_runtime
+
+    @bedrock_runtime.setter
+    def bedrock_runtime(self, client) -> None:
+        self._bedrock_runtime = client
+
+    def generate_sentences_from_stream(
+        self,
+        stream_body,
+        text_getter: Callable[[dict], str],
+        started_at: float | None = None,
+    ) -> Generator[str, None, None]:
+        """
+        `started_at` is the perf_counter() time of the request, used for the time to first token.
+        """
         sentence = []
-        for chunk in stream_body:
-            text = text_getter(chunk)
-            sentence.append(text)
-            if any(char in text for char in (".", "!", "?")):
+        first_token_at = sentence_done_at = None
+        try:
+            for chunk in stream_body:
+                text = text_getter(chunk)
+                if text and first_token_at is None:
+                    first_token_at = time.perf_counter()
+                    if started_at is not None:
+                        METRICS.observe("bedrock_time_to_first_token_seconds", first_token_at - started_at, model=self.model_id.value)
+                sentence.append(text)
+                if any(char in text for char in (".", "!", "?")):
+                    sentence_done_at = self.observe_sentence_done(sentence_done_at, started_at)
+                    yield "".join(sentence)
+                    sentence = []
+            if sentence:
+                self.observe_sentence_done(sentence_done_at, started_at)
                 yield "".join(sentence)
-                sentence = []
-        if sentence:
-            yield "".join(sentence)
+        finally:
+            # a consumer that stops early, e.g. a cancelled hedge, releases the connection
+            if hasattr(stream_body, "close"):
+                stream_body.close()
+
+    def observe_sentence_done(self, previous_sentence_done_at: float | None, started_at: float | None) -> float:
+        now = time.perf_counter()
+        if previous_sentence_done_at is not None:
+            METRICS.observe("bedrock_sentence_gap_seconds", now - previous_sentence_done_at, model=self.model_id.value)
+        elif started_at is not None:
+            METRICS.observe("bedrock_time_to_first_sentence_seconds", now - started_at, model=self.model_id.value)
+        return now
+
+    def get_messages(self, prompts: list[str]) -> list[dict]:
+        """
+        Alternating user/assistant messages in this model's content format.
+        """
+        roles = ("user", "assistant")
+        return [{"role": roles[i % 2], "content": [self.get_content(prompt)]} for i, prompt in enumerate(prompts)]
 
     @abstractmethod
     def get_text_from_chunk(self, chunk: dict) -> str:
         raise NotImplementedError
 
     @abstractmethod
-    def get_streamed_response(self, messages: list[dict], temperature: float = 0.9) -> Generator[str, None, None]:
+    def get_request(self, messages: list[dict], temperature: float = 0.9) -> dict:
         raise NotImplementedError
 
+    def invoke_stream(self, messages: list[dict], temperature: float = 0.9):
+        """
+        Starts a streamed request and returns the response body. Closing the body from another thread
+        aborts a stream that is still being read, e.g. the losing side of a hedged request.
+        """
+        response = self.bedrock_runtime.invoke_model_with_response_stream(
+            modelId=self.model_id.value,
+            body=json.dumps(self.get_request(messages, temperature)),
+        )
+        return response["body"]
+
+    def get_streamed_response(self, messages: list[dict], temperature: float = 0.9) -> Generator[str, None, None]:
+        started_at = time.perf_counter()
+        stream_body = self.invoke_stream(messages, temperature)
+        yield from self.generate_sentences_from_stream(stream_body, self.get_text_from_chunk, started_at)
+
     @abstractmethod
     def get_content(self, prompt: str) -> dict | list:
         raise NotImplementedError
 
     def get_model_stats(self) -> str:
-        avg = sum(self.delays) / len(self.delays)
-        min_delay, max_delay = min(self.delays), max(self.delays)
-        # self.delays.clear()
-        return f"{self.model_id.value} latencies: avg={avg:.2f}sec, min={min_delay:.2f}sec, max={max_delay:.2f}sec"
+        return METRICS.histogram("bedrock_generation_seconds", model=self.model_id.value).summary(f"{self.model_id.value} latencies")
 
 
 class Anthropic(Model):
-    def get_streamed_response(self, messages: list[dict], temperature: float = 0.9) -> Generator[str, None, None]:
-        request = json.dumps(
-            {
-                "anthropic_version": "bedrock-2023-05-31",
-                "max_tokens": 128,
-                "temperature": temperature,
-                "messages": messages,
-            }
-        )
-        stream = self.bedrock_runtime.invoke_model_with_response_stream(
-            modelId=self.model_id.value,
-            body=request,
-        )
-        yield from self.generate_sentences_from_stream(stream["body"], self.get_text_from_chunk)
+    def get_request(self, messages: list[dict], temperature: float = 0.9) -> dict:
+        return {
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": 128,
+            "temperature": temperature,
+            "messages": messages,
+        }
 
     def get_text_from_chunk(self, chunk: dict) -> str:
         delta = json.loads(chunk["chunk"]["bytes"].decode("utf-8")).get("delta")
@@ -88,22 +141,14 @@ class NovaPro(Model):
     def __init__(self, region="us-east-1") -> None:
         super().__init__(ModelID.NOVA_PRO, region)
 
-    def get_streamed_response(self, messages: list[dict], temperature: float = 0.9) -> Generator[str, None, None]:
-        request = json.dumps(
-            {
-                "inferenceConfig": {
-                    "max_new_tokens": 128,
-                    "temperature": temperature,
-                },
-                "messages": messages,
-            }
-        )
-
-        stream = self.bedrock_runtime.invoke_model_with_response_stream(
-            modelId=self.model_id.value,
-            body=request,
-        )
-        yield from self.generate_sentences_from_stream(stream["body"], self.get_text_from_chunk)
+    def get_request(self, messages: list[dict], temperature: float = 0.9) -> dict:
+        return {
+            "inferenceConfig": {
+                "max_new_tokens": 128,
+                "temperature": temperature,
+            },
+            "messages": messages,
+        }
 
     def get_content(self, prompt: str) -> dict:
         return {"text": prompt}
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import marshal
+import zlib
+from abc import ABC, abstractmethod
+from operator import itemgetter
+from typing import Any, Callable, get_args, get_origin
+
+from pydantic import BaseModel
+
+from application.dtos.game_state_event import GameState
+
+try:
+    import zstandard
+except ImportError:  # optional, the zstd codecs are only registered when it's installed
+    zstandard = None
+
+DEFAULT_CODEC = "json"
+# marshal's format 4 is what every supported Python version writes and reads
+MARSHAL_VERSION = 4
+
+
+class PayloadCodec(ABC):
+    """
+    Binary encoding of a dumped game state, stored in game_states.event_payload.
+    """
+
+    tag: str
+
+    @abstractmethod
+    def encode(self, snapshot: dict) -> bytes:
+        raise NotImplementedError
+
+    @abstractmethod
+    def decode(self, payload: bytes) -> dict:
+        raise NotImplementedError
+
+
+def dumps_compact(snapshot: dict) -> bytes:
+    return json.dumps(snapshot, separators=(",", ":")).encode()
+
+
+class ZlibCodec(PayloadCodec):
+    """zlib compressed compact JSON."""
+
+    tag = "zlib"
+
+    def __init__(self, level: int = 6) -> None:
+        self.level = level
+
+    def encode(self, snapshot: dict) -> bytes:
+        return zlib.compress(dumps_compact(snapshot), self.level)
+
+    def decode(self, payload: bytes) -> dict:
+        return json.loads(zlib.decompress(payload))
+
+
+class ZstdCodec(PayloadCodec):
+    """zstd compressed compact JSON."""
+
+    tag = "zstd"
+
+    def __init__(self, level: int = 3) -> None:
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def encode(self, snapshot: dict) -> bytes:
+        return self.compressor.compress(dumps_compact(snapshot))
+
+    def decode(self, payload: bytes) -> dict:
+        return json.loads(self.decompressor.decompress(payload))
+
+
+def is_model(annotation: Any) -> bool:
+    return isinstance(annotation, type) and issubclass(annotation, BaseModel)
+
+
+def holds_model_list(annotation: Any) -> bool:
+    if get_origin(annotation) is list:
+        return is_model(get_args(annotation)[0]) or holds_model_list(get_args(annotation)[0])
+    return is_model(annotation) and any(holds_model_list(field.annotation) for field in annotation.model_fields.values())
+
+
+def compile_layout(annotation: Any) -> tuple[Callable[[Any], Any], Callable[[Any], Any]] | None:
+    """
+    Converters from a model dump to its field values in declaration order, nested the same way, and back.
+    Only models holding lists of models, the game state and its players, are stored positionally. Smaller
+    ones like the shots stay dicts, marshal writes their repeated keys as back-references and rebuilds them
+    in C, faster than any conversion in Python. None for values stored as they are.
+    """
+    if get_origin(annotation) is list:
+        item = compile_layout(get_args(annotation)[0])
+        if item is None:
+            return None
+        item_to_values, item_from_values = item
+        return (lambda dump: list(map(item_to_values, dump))), (lambda values: list(map(item_from_values, values)))
+    if not holds_model_list(annotation):
+        return None
+
+    names = tuple(annotation.model_fields)
+    get_values = itemgetter(*names) if len(names) > 1 else lambda dump: (dump[names[0]],)
+    nested = [
+        (i, name, layout)
+        for i, (name, field) in enumerate(annotation.model_fields.items())
+        if (layout := compile_layout(field.annotation)) is not None
+    ]
+    if not nested:
+        return get_values, lambda values: dict(zip(names, values))
+
+    def to_values(dump: dict) -> tuple:
+        values = list(get_values(dump))
+        for i, name, (field_to_values, _) in nested:
+            values[i] = field_to_values(dump[name])
+        return tuple(values)
+
+    def from_values(values: tuple) -> dict:
+        dump = dict(zip(names, values))
+        for i, name, (_, field_from_values) in nested:
+            dump[name] = field_from_values(values[i])
+        return dump
+
+    return to_values, from_values
+
+
+GAME_STATE_TO_VALUES, GAME_STATE_FROM_VALUES = compile_layout(GameState)
+# bumped whenever compile_layout changes which models are stored positionally
+LAYOUT_FORMAT = 2
+GAME_STATE_LAYOUT_VERSION = hashlib.sha256(json.dumps([LAYOUT_FORMAT, GameState.model_json_schema()], sort_keys=True).encode()).hexdigest()[
+    :8
+]
+
+
+class MarshalCodec(PayloadCodec):
+    """
+    Compact binary encoding: the values of the dumped GameState and its players in field order, without keys,
+    serialized with marshal, optionally compressed. Decoding is marshal's C loader plus rebuilding the dicts, which is faster
+    than parsing the JSON. Payloads carry a fingerprint of the GameState schema they were written with, since
+    they can't be read once the fields change.
+    """
+
+    def __init__(
+        self, tag: str, compress: Callable[[bytes], bytes] | None = None, decompress: Callable[[bytes], bytes] | None = None
+    ) -> None:
+        self.tag = tag
+        self.compress = compress
+        self.decompress = decompress
+
+    def encode(self, snapshot: dict) -> bytes:
+        payload = marshal.dumps((GAME_STATE_LAYOUT_VERSION, GAME_STATE_TO_VALUES(snapshot)), MARSHAL_VERSION)
+        return self.compress(payload) if self.compress else payload
+
+    def decode(self, payload: bytes) -> dict:
+        layout_version, values = marshal.loads(self.decompress(payload) if self.decompress else payload)
+        if layout_version != GAME_STATE_LAYOUT_VERSION:
+            raise ValueError(
+                f"{self.tag} payload of GameState layout {layout_version}, current is {GAME_STATE_LAYOUT_VERSION}, re-ingest the dump"
+            )
+        return GAME_STATE_FROM_VALUES(values)
+
+
+CODECS: dict[str, PayloadCodec] = {
+    ZlibCodec.tag: ZlibCodec(),
+    "marshal": MarshalCodec("marshal"),
+    "marshal-zlib": MarshalCodec("marshal-zlib", zlib.compress, zlib.decompress),
+}
+if zstandard is not None:
+    CODECS[ZstdCodec.tag] = ZstdCodec()
+    CODECS["marshal-zstd"] = MarshalCodec("marshal-zstd", zstandard.ZstdCompressor().compress, zstandard.ZstdDecompressor().decompress)
+CODEC_TAGS = (DEFAULT_CODEC, *CODECS)
+
+
+def get_codec(tag: str) -> PayloadCodec:
+    if tag not in CODECS:
+        raise ValueError(f"Unknown payload codec {tag!r}, available: {list(CODEC_TAGS)}")
+    return CODECS[tag]
+
+
+def encode_event_data(snapshot: GameState | dict, tag: str) -> dict:
+    """
+    Returns the game_states column values for the game state, a DTO or its dump. The default codec keeps
+    the plain JSON text in event_data, the others store the encoded bytes in event_payload.
+    """
+    if isinstance(snapshot, GameState):
+        if tag == DEFAULT_CODEC:
+            # pydantic-core serializes straight to JSON, ~3x faster than dumping and json.dumps
+            return {"event_codec": tag, "event_data": snapshot.model_dump_json(), "event_payload": None}
+        snapshot = snapshot.model_dump()
+    if tag == DEFAULT_CODEC:
+        return {"event_codec": tag, "event_data": dumps_compact(snapshot).decode(), "event_payload": None}
+    return {"event_codec": tag, "event_data": None, "event_payload": get_codec(tag).encode(snapshot)}
+
+
+def decode_event_data(event) -> dict:
+    """Decodes a game_states row, rows written before codecs were introduced have no tag and hold JSON text."""
+    if event.event_codec in (None, DEFAULT_CODEC):
+        return json.loads(event.event_data)
+    return get_codec(event.event_codec).decode(event.event_payload)
@@ -0,0 +1,56 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# numbers are what mostly changes between game state prompts of consecutive ticks
+# a minus right after a word is a hyphen, "AK-47" becomes "ak-#"
+NUMBER_PATTERN = re.compile(r"(?<![\w-])-?\d+(?:\.\d+)?|\d+(?:\.\d+)?")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+
+def normalize_query(text: str, max_chars: int) -> str:
+    text = NUMBER_PATTERN.sub("#", text.lower())
+    return WHITESPACE_PATTERN.sub(" ", text).strip()[:max_chars]
+
+
+class RetrievalCache:
+    """
+    Knowledge base retrieval results by normalized query, dropped after `ttl_sec` so re-ingested documents
+    show up, and least recently used first once there are more than `max_entries`.
+    """
+
+    def __init__(self, ttl_sec: float, max_entries: int) -> None:
+        self.ttl_sec = ttl_sec
+        self.max_entries = max_entries
+        self.entries: OrderedDict[tuple, tuple[float, list[dict]]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def get(self, key: tuple) -> list[dict] | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] > self.ttl_sec:
+                del self.entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: tuple, passages: list[dict]) -> None:
+        with self.lock:
+            self.entries[key] = (time.monotonic(), passages)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_stats(self) -> str:
+        requests = self.hits + self.misses
+        hit_rate = self.hits / requests if requests else 0
+        return f"Retrieval cache: hits={self.hits}, misses={self.misses} ({self.expired} expired), hit rate={hit_rate:.0%}, entries={len(self.entries)}"
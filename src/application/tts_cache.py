@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+
+class TtsCache:
+    """
+    On-disk cache of synthesized audio, content-addressed by a hash of the text and the voice settings,
+    so re-runs and sweeps over the same match reuse earlier Polly output. File mtimes track recency,
+    the least recently used files are evicted once the cache grows over `max_bytes`. Hits are copied
+    into the output folder, output files never share an inode with a cache entry.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.size_bytes = sum(os.path.getsize(path) for path in self._cached_files())
+
+    def _cached_files(self) -> list[str]:
+        return [entry.path for entry in os.scandir(self.cache_dir) if entry.is_file() and not entry.name.endswith(".tmp")]
+
+    def get_path(self, text: str, settings: dict) -> str:
+        key = hashlib.sha256(json.dumps([text, settings], sort_keys=True).encode()).hexdigest()
+        return f"{self.cache_dir}/{key}.{settings.get('OutputFormat', 'bin')}"
+
+    def fetch(self, text: str, settings: dict, filename: str) -> bool:
+        """
+        Places the cached audio at `filename`, returns False on a miss.
+        """
+        path = self.get_path(text, settings)
+        try:
+            os.utime(path)
+            # replaced rather than written into, whatever is at `filename` may share its inode with other files
+            tmp_filename = f"{filename}.{threading.get_ident()}.tmp"
+            shutil.copyfile(path, tmp_filename)
+            os.replace(tmp_filename, filename)
+        except FileNotFoundError:  # never cached or evicted meanwhile
+            with self.lock:
+                self.misses += 1
+            return False
+        with self.lock:
+            self.hits += 1
+        return True
+
+    def store(self, text: str, settings: dict, filename: str) -> None:
+        path = self.get_path(text, settings)
+        if os.path.exists(path):
+            return
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        shutil.copyfile(filename, tmp_path)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.size_bytes += os.path.getsize(path)
+            if self.size_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        files = sorted(self._cached_files(), key=os.path.getmtime)
+        self.size_bytes = sum(os.path.getsize(path) for path in files)
+        for path in files:
+            if self.size_bytes <= self.max_bytes:
+                break
+            self.size_bytes -= os.path.getsize(path)
+            os.remove(path)
+
+    def get_stats(self) -> str:
+        requests = self.hits + self.misses
+        hit_rate = self.hits / requests if requests else 0
+        return f"TTS cache: hits={self.hits}, misses={self.misses}, hit rate={hit_rate:.0%}, size={self.size_bytes / 2**20:.1f}MiB"
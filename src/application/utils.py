@@ -2,7 +2,7 @@ import json
 import random
 from collections import deque
 
-from application.dtos.agent_service_config import InitPrompts
+CHARS_PER_TOKEN = 4
 
 
 def get_game_events(csv_filename: str) -> list[dict]:
@@ -17,15 +17,35 @@ def get_game_events(csv_filename: str) -> list[dict]:
     return kills
 
 
-def trim_queue(q: deque, context_window_size: int, init_prompts: InitPrompts) -> None:
-    init_prompts_list = init_prompts.to_list()
-    if len(q) + 2 > context_window_size:
-        for _ in range(len(init_prompts_list)):
-            q.popleft()
-        q.popleft()
-        q.popleft()
-        for prompt in reversed(init_prompts_list):
-            q.appendleft(prompt)
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token count estimate, about 4 characters per token for English and JSON alike.
+    """
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def trim_queue(
+    q: deque,
+    context_window_size: int,
+    init_prompts: list[str],
+    max_tokens: int | None = None,
+    incoming_text: str = "",
+) -> None:
+    """
+    Makes room for the next user/assistant exchange by dropping the oldest exchanges after the init prompts,
+    until both the message count and the estimated token count of the context, incoming text included, fit.
+    The init prompts are always kept.
+    """
+    prefix_size = len(init_prompts)
+    total_tokens = sum(estimate_tokens(message) for message in q) + estimate_tokens(incoming_text)
+
+    def too_large() -> bool:
+        return len(q) + 2 > context_window_size or (max_tokens is not None and total_tokens > max_tokens)
+
+    while len(q) >= prefix_size + 2 and too_large():
+        for _ in range(2):
+            total_tokens -= estimate_tokens(q[prefix_size])
+            del q[prefix_size]
 
 
 def dump_dialogue_to_file(filename: str, dialogue: dict) -> None: